@@ -9,6 +9,35 @@ d = os.path.dirname(argv[0])
 if d: # else current dir
     os.chdir(d)
 
+
+def headless ():
+    """Whether the command line asks for a mode that runs without a window.
+
+This has to be known before Pygame is initialised (and so before game.conf is
+imported), to choose SDL's dummy drivers.
+
+"""
+    for arg in argv[1:]:
+        if arg == '--':
+            break
+        elif arg.startswith('--'):
+            if arg.split('=', 1)[0] in ('--simulate', '--profile-levels',
+                                        '--benchmark'):
+                return True
+        elif arg.startswith('-'):
+            for c in arg[1:]:
+                if c in 'xb':
+                    return True
+                elif c in 'lctfnsr':
+                    # the rest is this option's value
+                    break
+    return False
+
+
+if headless():
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
+
 import pygame as pg
 from pygame.time import wait
 if os.name == 'nt':
@@ -22,7 +51,14 @@ from game.ui import LevelSelect
 from game.level import Level
 from game.conf import conf
 from game.util import ir, convert_sfc
-from game.ext.sched import Scheduler
+from game.dirty import DirtyRects
+from game.timing import FrameTimer
+from game.telemetry import Telemetry
+from game.sampler import Sampler
+from game.ext.sched import Scheduler, jitter
+from game import bench, profiling
+from game.sim import Simulation, idle_input
+from game.replay import Replay
 from game.ext import evthandler as eh
 if conf.USE_FONTS:
     from game.ext.fonthandler import Fonts
@@ -55,6 +91,7 @@ get_backends
 quit_backend
 img
 render_text
+load_sounds
 play_snd
 find_music
 play_music
@@ -84,7 +121,13 @@ files: loaded image cache (before resize).
 imgs: image cache.
 text: cache for rendered text.
 fonts: a fonthandler.Fonts instance, or None if conf.USE_FONTS is False.
+sounds: sound bank: {base_ID: sounds} for the IDs in conf.SOUNDS, where sounds
+        is a list of decoded pygame.mixer.Sound objects.
+sounds_size: the decoded size of all sounds in the bank, in bytes.
 music: filenames for known music.
+telemetry: telemetry.Telemetry instance; backends add to its counters.
+sampler: sampler.Sampler instance for the main thread, toggled by
+         conf.KEYS_SAMPLE.
 
 """
     # attributes to store with backends, and their initial values
@@ -96,8 +139,14 @@ music: filenames for known music.
     }
 
     def __init__ (self, *args, **kwargs):
-        self.scheduler = Scheduler()
+        self.scheduler = Scheduler(max_skip = conf.MAX_FRAME_SKIP,
+                                   precise = conf.PRECISE_TIMING,
+                                   record = conf.RECORD_FRAMES)
         self.scheduler.add_timeout(self._update, frames = 1, repeat_frames = 1)
+        self.dirty = DirtyRects()
+        self.frame_timer = FrameTimer()
+        self.telemetry = Telemetry(self._describe)
+        self.sampler = Sampler()
         # initialise caches
         self.files = {}
         self.imgs = {}
@@ -105,6 +154,8 @@ music: filenames for known music.
         # load display settings
         self.refresh_display()
         self.fonts = Fonts(conf.FONT_DIR) if conf.USE_FONTS else None
+        # decode sounds up front so playing them never touches the disk
+        self.load_sounds()
         # load move sound
         snd = pg.mixer.Sound(conf.SOUND_DIR + 'move.ogg')
         self.move_channel = c = pg.mixer.find_channel()
@@ -182,7 +233,10 @@ draw(screen) -> drawn: draw anything necessary to screen; drawn is True if the
                        called every frame.
 
 A pause method may optionally be defined, which takes no arguments and is
-called when the window loses focus to pause the game.
+called when the window loses focus to pause the game.  A refresh_display method
+may also be defined, which takes no arguments and is called after the display
+mode changes, for the backend to rebuild anything rendered for the old
+resolution.
 
 A backend is also given a dirty attribute, which indicates whether its draw
 method should redraw everything (it should set it to False when it does so).
@@ -210,6 +264,10 @@ backend should use for input, and is stored in its event_handler attribute.
         }, [
             (conf.KEYS_FULLSCREEN, self.toggle_fullscreen, eh.MODE_ONDOWN),
             (conf.KEYS_MINIMISE, self.minimise, eh.MODE_ONDOWN),
+            (conf.KEYS_TIMING, self.toggle_timing, eh.MODE_ONDOWN),
+            (conf.KEYS_TIMING_EXPORT, self.frame_timer.export,
+             eh.MODE_ONDOWN),
+            (conf.KEYS_SAMPLE, self.sampler.toggle, eh.MODE_ONDOWN),
             (conf.KEYS_VOL_UP, [(self._ch_vol, (v,))]) + r,
             (conf.KEYS_VOL_DOWN, [(self._ch_vol, (-v,))]) + r
         ], False, self.quit)
@@ -361,30 +419,59 @@ Returns the same value as fonthandler.Fonts
             self.text[key] = result
         return result
 
+    def load_sounds (self):
+        """Decode every sound listed in conf.SOUNDS into the sound bank."""
+        self.sounds = bank = {}
+        size = 0
+        init = pg.mixer.get_init()
+        if init is None:
+            # no mixer (such as without an audio device): sounds won't load, so
+            # there's no size to count
+            freq = sample_size = 0
+        else:
+            freq, fmt, channels = init
+            sample_size = channels * abs(fmt) / 8
+        for base_ID, n in conf.SOUNDS.iteritems():
+            sounds = []
+            for i in xrange(n):
+                fn = conf.SOUND_DIR + base_ID + str(i) + '.ogg'
+                try:
+                    snd = pg.mixer.Sound(fn)
+                except (pg.error, IOError):
+                    print 'warning: can\'t load sound: \'{0}\''.format(fn)
+                    continue
+                length = snd.get_length()
+                if length < 10 ** -3:
+                    # no way this is valid
+                    continue
+                sounds.append(snd)
+                size += int(length * freq) * sample_size
+            if sounds:
+                bank[base_ID] = sounds
+        self.sounds_size = size
+        if conf.DEBUG:
+            print 'info: decoded {0} sounds ({1:.1f} KiB)'.format(
+                sum(len(sounds) for sounds in bank.itervalues()), size / 1024.
+            )
+
     def play_snd (self, base_ID, volume = 1):
         """Play a sound.
 
 play_snd(base_ID, volume = 1)
 
-base_ID: the ID of the sound to play (we look for base_ID + i for a number i,
-         as many sounds as conf.SOUNDS[base_ID]).
+base_ID: the ID of the sound to play (we choose randomly from the sounds loaded
+         for it by Game.load_sounds).
 volume: float to scale volume by.
 
 """
         try:
-            n = conf.SOUNDS[base_ID]
+            sounds = self.sounds[base_ID]
         except KeyError:
             return
-        IDs = [base_ID + str(i) for i in xrange(n)]
-        ID = choice(IDs)
-        # load sound
-        snd = conf.SOUND_DIR + ID + '.ogg'
-        snd = pg.mixer.Sound(snd)
-        if snd.get_length() < 10 ** -3:
-            # no way this is valid
-            return
+        snd = choice(sounds)
         snd.set_volume(conf.VOL_MUL * conf.SOUND_VOLUME * conf.SOUND_VOLUMES.get(base_ID, 1) * volume)
         snd.play()
+        self.telemetry.count('sounds')
 
     def find_music (self):
         """Store a list of music files."""
@@ -409,16 +496,25 @@ volume: float to scale volume by.
 
     def _update (self):
         """Update backends and draw."""
+        ft = self.frame_timer
+        timing = ft.enabled
+        if timing:
+            ft.start()
         self._update_again = True
         while self._update_again:
             self._update_again = False
             self.backend.event_handler.update()
+            if timing:
+                ft.mark('events')
             # if a new backend was created during the above call, we'll end up
             # updating twice before drawing
             if not self._update_again:
                 self._update_again = False
                 self.backend.update()
+            if timing:
+                ft.mark('update')
         backend = self.backend
+        ident = get_backend_id(backend)
         # fade
         if self.fading:
             frame = self.scheduler.timer.frame
@@ -438,6 +534,17 @@ volume: float to scale volume by.
             else:
                 self.set_overlay(o)
                 data[3] += frame
+        if self.scheduler.timer.skipping:
+            # catching up: don't draw (backends' updates don't depend on
+            # drawing, so skipped frames play the same), and since the
+            # backend only knows what changed since its last update, redraw
+            # everything next time
+            backend.dirty = True
+            if timing:
+                ft.mark('overlay')
+                ft.end(ident)
+            self.telemetry.end_frame(self.scheduler.frame, ident)
+            return True
         # check overlay
         o0 = self._last_overlay
         o = self.overlay
@@ -457,11 +564,15 @@ volume: float to scale volume by.
                     # opaque: don't draw
                     draw = False
         s = self._overlay_sfc
+        if timing:
+            ft.mark('overlay')
         # draw backend
         screen = self.screen
+        dirty_rects = self.dirty
         if draw:
             dirty = backend.dirty
             draw = backend.draw(screen)
+            dirty_rects.add(draw)
             # if (overlay changed or drew something but perhaps not
             # everything), and we have an overlay (we know this will be
             # transparent), then draw everything (if dirty already drew
@@ -469,12 +580,10 @@ volume: float to scale volume by.
             if (draw or o != o0) and not dirty:
                 backend.dirty = True
                 new_draw = backend.draw(screen)
-                # merge draw and new_draw
-                if True in (draw, new_draw):
-                    draw = True
-                else:
-                    # know draw != False and now draw != True so is rect list
-                    draw = list(draw) + (list(new_draw) if new_draw else [])
+                dirty_rects.add(new_draw)
+                draw = draw or new_draw
+        if timing:
+            ft.mark('draw')
         # update overlay surface if changed
         if o not in (o0, False):
             if o_colour:
@@ -484,23 +593,61 @@ volume: float to scale volume by.
         # draw overlay if changed or backend drew
         if o is not False and (o != o0 or draw):
             screen.blit(s, (0, 0))
-            draw = True
+            dirty_rects.add(True)
             if o != o0:
                 backend.dirty = True
         self._last_overlay = self.overlay
+        if timing:
+            ft.mark('overlay')
+            r = ft.draw(screen)
+            if r is not None:
+                dirty_rects.add([r])
+            # don't count drawing the graph
+            ft.mark(None)
         # update display
-        if draw is True:
-            pg.display.flip()
-        elif draw:
-            pg.display.update(draw)
+        telemetry = self.telemetry
+        telemetry.set('dirty_pixels', dirty_rects.update(ident))
+        telemetry.set('dirty_rects', dirty_rects.n_rects)
+        if timing:
+            ft.mark('display')
+            ft.end(ident)
+        telemetry.end_frame(self.scheduler.frame, ident)
         return True
 
+    def _describe (self):
+        """Describe the backend stack and scheduler for telemetry dumps."""
+        stack = [data['backend'] for data in self.backends] + [self.backend]
+        lines = ['backends: ' + ', '.join(get_backend_id(b) for b in stack),
+                 'pending timeouts (frames, ID, callback):']
+        for frames, i, cb in self.scheduler.pending():
+            lines.append('    {0} {1} {2!r}'.format(frames, i, cb))
+        return lines
+
     def run (self, n = None):
         """Main loop."""
         self.scheduler.run(n)
+        if self.sampler.running:
+            # quit while sampling: keep the results
+            self.sampler.toggle()
+        self.telemetry.flush()
+        if conf.DEBUG:
+            self.dirty.report()
+            timer = self.scheduler.timer
+            mean, stdev, worst = jitter(timer.intervals, timer.frame)
+            print 'info: frame interval mean {0:.2f}ms, stdev {1:.2f}ms, ' \
+                  'worst {2:.2f}ms from target'.format(
+                1000 * mean, 1000 * stdev, 1000 * worst
+            )
 
     def quit (self, event = None):
         """Quit the game."""
+        # finish any recordings in progress, rather than leaving it to garbage
+        # collection
+        backends = [data['backend'] for data in self.backends]
+        backends.append(getattr(self, 'backend', None))
+        for backend in backends:
+            if isinstance(backend, Level):
+                backend.stop_recording()
         self.scheduler.timer.stop()
 
     def restart (self, *args):
@@ -696,9 +843,21 @@ Takes the same arguments as Game.colour_fade, without fn and time.
             self.backend.dirty = True
         except AttributeError:
             pass
+        else:
+            refresh = getattr(self.backend, 'refresh_display', None)
+            if refresh is not None:
+                refresh()
         # clear image cache (very unlikely we'll need the same sizes)
         self.imgs = {}
 
+    def toggle_timing (self, *args):
+        """Toggle frame timing and its on-screen graph."""
+        ft = self.frame_timer
+        ft.toggle()
+        if not ft.enabled:
+            # remove the graph
+            self.backend.dirty = True
+
     def toggle_fullscreen (self, *args):
         """Toggle fullscreen mode."""
         if conf.RESIZABLE:
@@ -744,13 +903,45 @@ if __name__ == '__main__':
                   type = 'int')
     op.add_option('-s', '--sort-stats', action = 'store', dest = 'sort_stats',
                   type = 'string')
+    op.add_option('-k', '--keep-stats', action = 'store_true',
+                  dest = 'keep_stats')
+    op.add_option('--profile-levels', action = 'store', dest = 'profile_levels',
+                  type = 'string')
+    op.add_option('--profile-dir', action = 'store', dest = 'profile_dir',
+                  type = 'string')
+    op.add_option('-b', '--benchmark', action = 'store', dest = 'benchmark',
+                  type = 'choice', choices = sorted(bench.BENCHMARKS))
+    op.add_option('--bench-n', action = 'store', dest = 'bench_n',
+                  type = 'int')
+    op.add_option('--bench-out', action = 'store', dest = 'bench_out',
+                  type = 'string')
+    op.add_option('--replay-dir', action = 'store', dest = 'replay_dir',
+                  type = 'string')
+    op.add_option('-x', '--simulate', action = 'store_true', dest = 'sim')
+    op.add_option('--sim-frames', action = 'store', dest = 'sim_frames',
+                  type = 'int')
+    op.add_option('--sim-draw', action = 'store_true', dest = 'sim_draw')
+    op.add_option('-r', '--record', action = 'store', dest = 'record',
+                  type = 'string')
+    op.add_option('--replay', action = 'store', dest = 'replay',
+                  type = 'string')
     op.add_option('-d', '--debug', action = 'store_true', dest = 'debug')
     op.set_defaults(cp = -1, ls = False, time = conf.PROFILE_TIME,
-                    fn = conf.PROFILE_STATS_FILE,
+                    fn = None,
                     num_stats = conf.PROFILE_NUM_STATS,
-                    sort_stats = conf.PROFILE_STATS_SORT, debug = False)
+                    sort_stats = conf.PROFILE_STATS_SORT,
+                    keep_stats = False, profile_dir = conf.PROFILE_DIR,
+                    bench_n = conf.BENCHMARK_N,
+                    bench_out = conf.BENCHMARK_FILE,
+                    replay_dir = conf.REPLAY_DIR, sim = False,
+                    sim_frames = conf.SIM_FRAMES, sim_draw = False,
+                    debug = False)
     options = op.parse_args()[0]
     conf.DEBUG = options.debug
+    if options.record is not None:
+        conf.RECORD_DIR = options.record
+        if not os.path.isdir(options.record):
+            os.makedirs(options.record)
     level = options.level
     if level is not None:
         cls = Level
@@ -765,15 +956,47 @@ if __name__ == '__main__':
         else:
             cls = Level
             level_args = (conf.CURRENT_LEVEL,)
-    if options.profile:
+    if options.sim:
+        # headless simulation, as fast as possible
+        if options.replay is not None:
+            r = Replay(options.replay)
+            sim = r.simulate(Game(Level, r.ID, r.cp), options.sim_draw)
+        else:
+            ID = conf.CURRENT_LEVEL if level is None else level
+            g = Game(Level, ID, options.cp)
+            sim = Simulation(g, ID, options.cp,
+                             idle_input(options.sim_frames), options.sim_draw)
+        n, t = sim.run()
+        print 'simulated {0} frames in {1:.3f}s: {2:.1f} FPS'.format(
+            n, t, n / t if t else 0
+        )
+    elif options.profile_levels is not None:
+        # profile levels headlessly, one after another
+        IDs = profiling.parse_levels(options.profile_levels)
+        if IDs is None:
+            op.error('--profile-levels takes \'all\' or a comma-separated '
+                     'list of level IDs')
+        if options.fn is not None:
+            op.error('-f is for --profile; --profile-levels writes to '
+                     '--profile-dir')
+        profiling.profile_levels(Game(Level, IDs[0], save_progress = False),
+                                 IDs, options)
+    elif options.benchmark is not None:
+        bench.BENCHMARKS[options.benchmark](Game(cls, *level_args), options)
+    elif options.profile:
         # profile
         from cProfile import run as profile
         from pstats import Stats
         t = options.time * conf.FPS[get_backend_id(cls)]
         fn = options.fn
+        if fn is None:
+            fn = conf.PROFILE_STATS_FILE
         profile('Game({0}, *level_args).run(t)'.format(cls.__name__), fn, locals())
         Stats(fn).strip_dirs().sort_stats(options.sort_stats).print_stats(options.num_stats)
-        os.unlink(fn)
+        if options.keep_stats:
+            print 'info: kept profile data in \'{0}\''.format(fn)
+        else:
+            os.unlink(fn)
     else:
         # run normally
         restarting = True
@@ -781,4 +1004,6 @@ if __name__ == '__main__':
             restarting = False
             Game(cls, *level_args).run()
 
+# make sure saved settings are on disk before we exit
+conf.flush()
 pg.quit()
@@ -0,0 +1,288 @@
+"""Benchmarks, run through game.py's --benchmark option.
+
+Each benchmark is a function taking the running Game instance and the options
+parsed by game.py, and printing its results.
+
+"""
+
+import os
+import json
+from time import time
+from random import choice, Random
+
+import pygame as pg
+
+from conf import conf
+from replay import Replay, simulate_level
+from ext.sched import Scheduler, Timer, jitter
+
+
+def percentiles (ts, ps = (50, 95, 99, 100)):
+    """Get percentiles of a list of times.
+
+percentiles(ts, ps = (50, 95, 99, 100)) -> values
+
+ts: list of times.
+ps: the percentiles to compute.
+
+values: {percentile: value} dict (nearest-rank method).  Values are all 0 if ts
+        is empty.
+
+"""
+    ts = sorted(ts)
+    n = len(ts)
+    if n == 0:
+        return dict((p, 0) for p in ps)
+    return dict((p, ts[min(n - 1, max(0, int(round(p * n / 100.)) - 1))])
+                for p in ps)
+
+
+def mean (ts):
+    """Get the mean of a list of times, or 0 if it's empty."""
+    return float(sum(ts)) / len(ts) if ts else 0
+
+
+def _fmt_ms (t):
+    return '{0:.4f}ms'.format(1000 * t)
+
+
+def sounds (game, options):
+    """Compare sound bank playback against decoding sounds from disk."""
+    n = options.bench_n
+    IDs = ['hit' + str(i) for i in xrange(conf.SOUNDS['hit'])]
+    # old path: decode every call
+    disk = []
+    for i in xrange(n):
+        t0 = time()
+        snd = pg.mixer.Sound(conf.SOUND_DIR + choice(IDs) + '.ogg')
+        snd.set_volume(0)
+        snd.play()
+        disk.append(time() - t0)
+    # bank
+    bank = []
+    for i in xrange(n):
+        t0 = time()
+        game.play_snd('hit', 0)
+        bank.append(time() - t0)
+    print 'sound bank: {0:.1f} KiB decoded'.format(game.sounds_size / 1024.)
+    for name, ts in (('disk', disk), ('bank', bank)):
+        p = percentiles(ts)
+        print '{0}: mean {1}, p50 {2}, p99 {3}, max {4}'.format(
+            name, _fmt_ms(mean(ts)), _fmt_ms(p[50]), _fmt_ms(p[99]),
+            _fmt_ms(p[100])
+        )
+
+
+def levels (game, options):
+    """Time each phase of each frame while replaying every level.
+
+Levels are replayed from options.replay_dir, and are left idle for
+options.sim_frames frames if there is no recording for them.  Results are
+written as JSON to options.bench_out.
+
+"""
+    phases = ('events', 'update', 'draw', 'display')
+    results = {}
+    screen = game.screen
+    dirty = game.dirty
+    for ID in xrange(len(conf.LEVELS)):
+        ts = dict((phase, []) for phase in phases)
+        last = [None]
+
+        def mark (phase):
+            t = time()
+            ts[phase].append(t - last[0])
+            last[0] = t
+
+        def draw (l):
+            dirty.add(l.draw(screen))
+
+        sim, replayed = simulate_level(game, options.replay_dir, ID,
+                                       options.sim_frames, draw = draw,
+                                       backend = True, mark = mark)
+        pixels = 0
+        while True:
+            last[0] = time()
+            if not sim.step():
+                break
+            pixels += dirty.update(ID)
+            mark('display')
+        if sim.level is not game.backend:
+            print 'warning: level {0} stopped being the current backend ' \
+                  'after {1} frames'.format(ID, sim.frames)
+        # drop phases of a frame that wasn't finished
+        n = sim.frames
+        for phase in phases:
+            del ts[phase][n:]
+        result = {'frames': n, 'replay': replayed,
+                  'dirty_pixels': float(pixels) / n if n else 0}
+        print 'level {0} ({1} frames{2}, {3:.0f} dirty pixels/frame):'.format(
+            ID, n, '' if replayed else ', no recording',
+            result['dirty_pixels']
+        )
+        for phase in phases:
+            p = percentiles(ts[phase])
+            result[phase] = {'p50': p[50], 'p95': p[95], 'p99': p[99],
+                             'max': p[100]}
+            print '    {0:>8}: p50 {1}, p95 {2}, p99 {3}, max {4}'.format(
+                phase, *(_fmt_ms(p[x]) for x in (50, 95, 99, 100))
+            )
+        results[ID] = result
+    try:
+        with open(options.bench_out, 'w') as f:
+            json.dump(results, f, indent = 4, sort_keys = True)
+    except IOError:
+        print 'warning: can\'t write to file: \'{0}\''.format(
+            options.bench_out
+        )
+
+
+def _trace (sim):
+    """Run a simulation, recording player and window positions.
+
+_trace(sim) -> (trace, t)
+
+trace: list of (player_rect, window, dying) for every frame.
+t: time spent simulating, in seconds.
+
+"""
+    trace = []
+    t = 0
+    l = sim.level
+    while True:
+        t0 = time()
+        running = sim.step()
+        t += time() - t0
+        if not running:
+            break
+        trace.append((tuple(l.player.rect), tuple(l.window), l.dying))
+    return (trace, t)
+
+
+def sweep (game, options):
+    """Check that swept and stepped window movement agree.
+
+Every recording in options.replay_dir is replayed with each method, comparing
+positions every frame.
+
+"""
+    d = options.replay_dir
+    try:
+        fns = sorted(f for f in os.listdir(d) if f.endswith('.replay'))
+    except OSError:
+        fns = []
+    agree = 0
+    for fn in fns:
+        try:
+            r = Replay(os.path.join(d, fn))
+        except (IOError, ValueError), e:
+            print 'warning: can\'t load recording: {0}'.format(e)
+            continue
+        results = []
+        for swept in (False, True):
+            sim = r.simulate(game)
+            sim.level.swept_window = swept
+            results.append(_trace(sim))
+        (stepped, t_stepped), (swept, t_swept) = results
+        diff = [i for i, (a, b) in enumerate(zip(stepped, swept)) if a != b]
+        if len(stepped) != len(swept):
+            diff.append(min(len(stepped), len(swept)))
+        if diff:
+            status = 'differ from frame {0}'.format(diff[0])
+        else:
+            status = 'agree'
+            agree += 1
+        print '{0}: {1} ({2} frames; stepped {3:.3f}s, swept {4:.3f}s)'.format(
+            fn, status, len(stepped), t_stepped, t_swept
+        )
+    print '{0}/{1} recordings agree'.format(agree, len(fns))
+
+
+def replays (game, options):
+    """Check that recordings replay the same way they were played.
+
+Every recording in options.replay_dir that has the player's live positions is
+replayed, comparing positions every frame.
+
+"""
+    d = options.replay_dir
+    try:
+        fns = sorted(f for f in os.listdir(d) if f.endswith('.replay'))
+    except OSError:
+        fns = []
+    checked = agree = 0
+    for fn in fns:
+        try:
+            r = Replay(os.path.join(d, fn))
+        except (IOError, ValueError), e:
+            print 'warning: can\'t load recording: {0}'.format(e)
+            continue
+        if r.trace is None:
+            print '{0}: no positions recorded'.format(fn)
+            continue
+        checked += 1
+        sim = r.simulate(game, trace = True)
+        sim.run()
+        live = [tuple(pos) for pos in r.trace]
+        diff = [i for i, (a, b) in enumerate(zip(live, sim.trace)) if a != b]
+        if len(live) != len(sim.trace):
+            diff.append(min(len(live), len(sim.trace)))
+        if diff:
+            status = 'differs from frame {0}'.format(diff[0])
+        else:
+            status = 'agrees'
+            agree += 1
+        print '{0}: {1} ({2} frames)'.format(fn, status, len(live))
+    print '{0}/{1} recordings agree'.format(agree, checked)
+
+
+def sched (game, options):
+    """Time scheduler frames with different numbers of pending timeouts.
+
+Each timeout repeats with a random period of up to 10 seconds; options.bench_n
+frames are run for each number of timeouts.
+
+"""
+    rand = Random(0)
+    cb = lambda: True
+    for n in (10, 1000, 100000):
+        s = Scheduler()
+        for i in xrange(n):
+            s.add_timeout(cb, frames = rand.randint(1, 600))
+        ts = []
+        for i in xrange(options.bench_n):
+            t0 = time()
+            s._update()
+            ts.append(time() - t0)
+        p = percentiles(ts)
+        print '{0} timeouts: mean {1}, p50 {2}, p99 {3}, max {4}'.format(
+            n, _fmt_ms(mean(ts)), _fmt_ms(p[50]), _fmt_ms(p[99]),
+            _fmt_ms(p[100])
+        )
+
+
+def timer (game, options):
+    """Compare frame interval jitter with and without precise pacing.
+
+Runs options.bench_n empty frames at conf.FPS[None] with each pacing strategy.
+
+"""
+    n = options.bench_n
+    for precise in (False, True):
+        t = Timer(conf.FPS[None], precise = precise, record = n)
+        t.run(lambda: None, frames = n + 1)
+        mean, stdev, worst = jitter(t.intervals, t.frame)
+        print '{0}: mean {1}, stdev {2}, worst {3} from target'.format(
+            'precise' if precise else 'default', _fmt_ms(mean),
+            _fmt_ms(stdev), _fmt_ms(worst)
+        )
+
+
+BENCHMARKS = {
+    'levels': levels,
+    'replays': replays,
+    'sched': sched,
+    'sounds': sounds,
+    'sweep': sweep,
+    'timer': timer
+}
@@ -36,6 +36,10 @@ class Conf (object):
     else:
         CONF_DIR = join_path(os.path.expanduser(u'~'), '.config', IDENT)
     CONF = join_path(CONF_DIR, 'conf')
+    # level select thumbnail cache (None to disable)
+    THUMB_DIR = join_path(CONF_DIR, 'thumbs') if USE_SAVEDATA else None
+    # telemetry dumps for slow frames (None to disable)
+    HITCH_DIR = join_path(CONF_DIR, 'hitches') if USE_SAVEDATA else None
 
     # paths
     DATA_DIR = ''
@@ -51,13 +55,30 @@ class Conf (object):
     FULLSCREEN = False
     RESIZABLE = False # also determines whether fullscreen togglable
     RES_W = (960, 540)
-    RES_F = pg.display.list_modes()[0]
+    try:
+        RES_F = pg.display.list_modes()[0]
+    except (pg.error, TypeError, IndexError):
+        # no display, or no particular modes (list_modes() returns -1)
+        RES_F = RES_W
     RES = RES_W
     MIN_RES_W = (320, 180)
     ASPECT_RATIO = None
+    DIRTY_MERGE_DIST = 8 # merge dirty rects closer than this, in pixels
+    # flip the whole display if more than this fraction of it changed (until
+    # the actual cost of flipping has been measured)
+    DIRTY_FLIP_RATIO = .5
 
     # timing
     FPS = dd(60) # keys are backend IDs
+    # frames that can be updated without drawing to keep up when running slow
+    # (0 to let the game slow down instead); the frame drawn after skipping
+    # redraws everything
+    MAX_FRAME_SKIP = 0
+    PRECISE_TIMING = False # monotonic clock, sleep then spin
+    RECORD_FRAMES = 600 # number of frame intervals to keep for statistics
+    TELEMETRY_FRAMES = 300 # frames of telemetry to keep for hitch dumps
+    HITCH_TIME = .1 # dump telemetry when a frame takes longer, in seconds
+    HITCH_MAX_DUMPS = 10 # per session
 
     # debug
     DEBUG = False
@@ -65,11 +86,31 @@ class Conf (object):
     PROFILE_STATS_FILE = '.profile_stats'
     PROFILE_NUM_STATS = 20
     PROFILE_STATS_SORT = 'cumulative'
+    PROFILE_DIR = 'profile' # for --profile-levels results
+    # seconds between profiler samples; each one contends for the GIL
+    SAMPLE_INTERVAL = .01
+    SAMPLE_FILE = 'samples-{0}.folded' # formatted with the time
+    TIMING_FRAMES = 3600 # frame timings to keep for export
+    TIMING_FILE = 'timing-{0}.csv' # formatted with backend ID
+    TIMING_HUD_SIZE = (240, 80) # graph height is two frames at target FPS
+    TIMING_HUD_BG = (0, 0, 0)
+    TIMING_HUD_LINE = (255, 255, 255)
+    TIMING_COLOURS = {'events': (200, 200, 50), 'update': (50, 200, 50),
+                      'overlay': (200, 50, 200), 'draw': (50, 100, 250),
+                      'display': (250, 80, 50)}
+    BENCHMARK_N = 1000
+    BENCHMARK_FILE = 'bench.json'
+    REPLAY_DIR = 'replays'
+    SIM_FRAMES = 3600
+    RECORD_DIR = None # directory to record level input to
 
     # input
     KEYS_NEXT = (pg.K_RETURN, pg.K_SPACE, pg.K_KP_ENTER)
     KEYS_BACK = (pg.K_ESCAPE, pg.K_BACKSPACE)
     KEYS_MINIMISE = (pg.K_F10,)
+    KEYS_TIMING = (pg.K_F3,)
+    KEYS_TIMING_EXPORT = (pg.K_F4,)
+    KEYS_SAMPLE = (pg.K_F5,)
     KEYS_FULLSCREEN = (pg.K_F11, (pg.K_RETURN, pg.KMOD_ALT, True),
                     (pg.K_KP_ENTER, pg.KMOD_ALT, True))
     KEYS_LEFT = (pg.K_LEFT, pg.K_a, pg.K_q)
@@ -119,7 +160,11 @@ class Conf (object):
     HALF_WINDOW_SIZE = (125, 75)
     WINDOW_SIZE = [x * 2 for x in HALF_WINDOW_SIZE]
     ERR = 10 ** -10
+    MAX_SEED = 2 ** 32 - 2 # for each level's random numbers
     WINDOW_MOVE_AMOUNT = 3
+    # only stop the window where it hits the player (else at every step)
+    SWEPT_WINDOW = True
+    GRID_CELL_SIZE = 64 # for collision detection
 
     # levels (all positions must be ints)
     LEVELS = [{
@@ -431,6 +476,8 @@ class Conf (object):
     LS_FADE_OUT = (False, ((0, 0, 0), 1.5))
     LS_LEVEL_START_TIME = 2
     LS_WON_OVERLAY = (0, 0, 0, 150)
+    LS_PLACEHOLDER_COLOUR = (90, 90, 90)
+    LS_THUMB_BUDGET = .008 # seconds per frame to spend making thumbnails
     # images
     DEFAULT_BGS = ('bg',)
     BGS = DEFAULT_BGS + sum((l.get('bgs', ()) for l in LEVELS), ())
@@ -441,6 +488,7 @@ class Conf (object):
     CLOUD_VERT_SPEED_RATIO = .1
     CLOUD_MOD_SPEED_RATIO = .2
     CLOUD_JITTER = .01
+    TILE_CACHE_SIZE = 2 ** 23 # total pixels of pre-tiled surfaces to keep
     PLAYER_OFFSET = (-7, -2)
     PLAYER_SQUASH_ELAST = .7
     PLAYER_SQUASH_STIFFNESS = .2
@@ -449,8 +497,10 @@ class Conf (object):
     PLAYER_SKEW_ELAST = .85
     PLAYER_SKEW_STIFFNESS = .1
     PLAYER_MAX_SKEW = 4
+    PLAYER_FRAME_CACHE_SIZE = 256 # scaled player frames to keep
     GOAL_OFFSET = (-17, -2)
     STAR_PULSE_SPEED = .005
+    STAR_GLOW_FRAMES = 32 # glow levels to prerender
     VOID_JITTER_X = 10
     VOID_JITTER_Y = 10
     VOID_JITTER_T = 5
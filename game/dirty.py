@@ -0,0 +1,160 @@
+from time import time
+
+import pygame as pg
+from pygame import Rect
+
+from conf import conf
+
+
+def merge_rects (rects, dist = 0):
+    """Merge rects that overlap or are close together.
+
+merge_rects(rects, dist = 0) -> merged
+
+rects: a list of rects (anything like (left, top, width, height)).
+dist: rects closer than this many pixels are merged.
+
+merged: a list of pygame.Rect instances covering all the given rects, no two of
+        which are within dist of each other.  The result is a superset of the
+        area covered by rects.
+
+"""
+    rects = [Rect(r) for r in rects]
+    merged = True
+    while merged:
+        merged = False
+        done = []
+        for r in rects:
+            grown = r.inflate(2 * dist, 2 * dist)
+            for i, other in enumerate(done):
+                if grown.colliderect(other):
+                    done[i] = other.union(r)
+                    merged = True
+                    break
+            else:
+                done.append(r)
+        rects = done
+    return rects
+
+
+class DirtyRects (object):
+    """Collects the areas of the display that changed and updates them.
+
+    CONSTRUCTOR
+
+DirtyRects(merge_dist = conf.DIRTY_MERGE_DIST,
+           flip_ratio = conf.DIRTY_FLIP_RATIO)
+
+merge_dist: dirty rects closer than this many pixels are merged.
+flip_ratio: until update and flip speeds have been measured, flip the whole
+            display instead of updating rects if the dirty area is more than
+            this fraction of the screen.
+
+    METHODS
+
+add
+update
+report
+
+    ATTRIBUTES
+
+all: whether the whole display is dirty this frame.
+rects: the rects added so far this frame.
+flip_threshold: dirty area in pixels above which the whole display is flipped;
+                measured from the time taken by previous updates and flips.
+pixels, flipped: the number of pixels updated in the last frame, and whether it
+                 was a flip.
+n_rects: the number of rects updated in the last frame (1 for a flip).
+stats: {ident: [frames, pixels, flips]} totals for each identifier passed to
+       update.
+
+"""
+
+    def __init__ (self, merge_dist = conf.DIRTY_MERGE_DIST,
+                  flip_ratio = conf.DIRTY_FLIP_RATIO):
+        self.merge_dist = merge_dist
+        self.flip_ratio = flip_ratio
+        self.all = False
+        self.rects = []
+        self.flip_threshold = None
+        self.pixels = 0
+        self.flipped = False
+        self.n_rects = 0
+        self.stats = {}
+        # moving averages: seconds per flip, seconds per updated pixel
+        self._t_flip = None
+        self._t_pixel = None
+
+    def add (self, drawn):
+        """Mark areas of the display as dirty.
+
+add(drawn)
+
+drawn: as returned by a backend's draw method: True for the whole display,
+       something falsy for nothing, or a list of rects.
+
+"""
+        if drawn is True:
+            self.all = True
+        elif drawn:
+            self.rects.extend(drawn)
+
+    def _measure (self, attr, t):
+        old = getattr(self, attr)
+        setattr(self, attr, t if old is None else .9 * old + .1 * t)
+
+    def update (self, ident = None):
+        """Update the dirty areas of the display and start a new frame.
+
+update(ident = None) -> pixels
+
+ident: identifier to record statistics under in the stats attribute, such as a
+       backend ID.
+
+pixels: the number of pixels updated.
+
+"""
+        w, h = screen_size = pg.display.get_surface().get_size()
+        area = w * h
+        rects = []
+        pixels = 0
+        if not self.all and self.rects:
+            screen = Rect((0, 0), screen_size)
+            rects = [r for r in (r.clip(screen) for r in
+                                 merge_rects(self.rects, self.merge_dist))
+                     if r.w > 0 and r.h > 0]
+            pixels = sum(r.w * r.h for r in rects)
+            threshold = self.flip_threshold
+            if threshold is None:
+                threshold = self.flip_ratio * area
+            if pixels > threshold:
+                self.all = True
+        if self.all:
+            t0 = time()
+            pg.display.flip()
+            self._measure('_t_flip', time() - t0)
+            pixels = area
+        elif rects:
+            t0 = time()
+            pg.display.update(rects)
+            self._measure('_t_pixel', (time() - t0) / pixels)
+        if self._t_flip is not None and self._t_pixel:
+            self.flip_threshold = self._t_flip / self._t_pixel
+        # statistics
+        self.pixels = pixels
+        self.flipped = self.all
+        self.n_rects = 1 if self.all else len(rects)
+        stats = self.stats.setdefault(ident, [0, 0, 0])
+        stats[0] += 1
+        stats[1] += pixels
+        stats[2] += self.all
+        self.all = False
+        self.rects = []
+        return pixels
+
+    def report (self):
+        """Print the statistics in the stats attribute."""
+        for ident, (frames, pixels, flips) in sorted(self.stats.iteritems()):
+            print 'info: {0}: {1:.0f} dirty pixels/frame, {2} flips in ' \
+                  '{3} frames'.format(ident, float(pixels) / frames, flips,
+                                      frames)
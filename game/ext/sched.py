@@ -9,6 +9,9 @@ sched.wait = wait_function
 This function should take the number of milliseconds to wait for.  This will
 always be an integer.
 
+Timers can also pace frames precisely, using the monotonic high-resolution clock
+function from this module.
+
 Python version: 2.
 Release: 6-dev.
 
@@ -16,6 +19,11 @@ Licensed under the GNU General Public License, version 3; if this was not
 included, you can find it here:
     http://www.gnu.org/licenses/gpl-3.0.txt
 
+    FUNCTIONS
+
+clock
+jitter
+
     CLASSES
 
 Timer
@@ -23,15 +31,78 @@ Scheduler
 
 """
 
-from time import time
+import os
+import sys
+from time import time, sleep
+from math import sqrt
+from collections import deque
+from heapq import heappush, heappop, heapify
 
 try:
     from pygame.time import wait
 except ImportError:
-    from time import sleep
-
     def wait (t):
-        sleep(int(t * 1000))
+        sleep(t / 1000.)
+
+
+def _get_clock ():
+    # find the best monotonic clock available
+    if sys.platform == 'win32':
+        # uses QueryPerformanceCounter
+        from time import clock
+        return clock
+    try:
+        import ctypes
+        import ctypes.util
+
+        class timespec (ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        lib = ctypes.CDLL(ctypes.util.find_library('rt') or
+                          ctypes.util.find_library('c'), use_errno = True)
+        clock_gettime = lib.clock_gettime
+        clock_gettime.argtypes = (ctypes.c_int, ctypes.POINTER(timespec))
+        # CLOCK_MONOTONIC is 1 on Linux and the BSDs, 6 on OS X
+        clk_id = 6 if sys.platform == 'darwin' else 1
+        ts = timespec()
+        ts_p = ctypes.pointer(ts)
+        if clock_gettime(clk_id, ts_p) != 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+    except (ImportError, OSError, AttributeError, TypeError):
+        # no clock_gettime
+        return time
+
+    def clock ():
+        clock_gettime(clk_id, ts_p)
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+
+    return clock
+
+# clock() -> t: the time from a monotonic clock, in seconds; only differences
+# between values are meaningful.  Falls back to time.time if no monotonic clock
+# is available.
+clock = _get_clock()
+
+
+def jitter (intervals, frame):
+    """Compute frame interval statistics.
+
+jitter(intervals, frame) -> (mean, stdev, worst)
+
+intervals: a sequence of achieved frame lengths, in seconds.
+frame: the target frame length.
+
+mean, stdev: the mean and standard deviation of intervals.
+worst: the largest difference between an interval and frame.
+
+"""
+    n = len(intervals)
+    if n == 0:
+        return (0, 0, 0)
+    mean = float(sum(intervals)) / n
+    stdev = sqrt(sum((t - mean) ** 2 for t in intervals) / n)
+    worst = max(abs(t - frame) for t in intervals)
+    return (mean, stdev, worst)
 
 
 class Timer:
@@ -42,9 +113,21 @@ what you need to.
 
     CONSTRUCTOR
 
-Timer(fps = 60)
+Timer(fps = 60, max_skip = 0, precise = False, record = 0)
 
 fps: frames per second to aim for.
+max_skip: if greater than 0, run uses a fixed timestep: when a frame takes too
+          long, up to this many following frames are run as quickly as
+          possible to catch up, with the skipping attribute set during them.
+          The callback should skip drawing when it's set.  If still behind
+          after that, the lost time is dropped.
+precise: whether to pace frames precisely: time frames with clock, sleep until
+         shortly before the end of a frame, then yield to other threads until
+         it ends.  Otherwise, frames are timed with time.time and a whole
+         number of milliseconds is waited for.
+record: keep the lengths of this many of the most recent frames (from the start
+        of one call to the callback to the start of the next) in the intervals
+        attribute.
 
     METHODS
 
@@ -52,18 +135,56 @@ run
 step
 stop
 set_fps
+set_precise
 
     ATTRIBUTES
 
 fps: the current target FPS.  Use the set_fps method to change it.
 frame: the current length of a frame in seconds.
+max_skip: as taken by the constructor.
+skipping: whether the current frame is being run only to catch up (see
+          max_skip).
+precise: as taken by the constructor.  Use the set_precise method to change it.
+spin: when precise, the time in seconds before the end of a frame to stop
+      sleeping and start yielding.
+intervals: recorded frame lengths (see the record argument), oldest first; pass
+           to jitter for statistics.
 t: the time at the last step, if using individual steps.
 
 """
 
-    def __init__ (self, fps = 60):
+    def __init__ (self, fps = 60, max_skip = 0, precise = False, record = 0):
         self.set_fps(fps)
-        self.t = time()
+        self.max_skip = max_skip
+        self.skipping = False
+        self.precise = precise
+        self.spin = .002
+        self.intervals = deque(maxlen = record)
+        self._last = None
+        self.t = self._now()
+
+    def _now (self):
+        return clock() if self.precise else time()
+
+    def _delay (self, t, dt):
+        # wait for dt seconds from time t (as returned by _now)
+        if self.precise:
+            end = t + dt
+            coarse = dt - self.spin
+            if coarse > 0:
+                wait(int(1000 * coarse))
+            while clock() < end:
+                sleep(0)
+        else:
+            wait(int(1000 * dt))
+
+    def _record (self):
+        # record the time since the last frame started
+        if self.intervals.maxlen:
+            t = self._now()
+            if self._last is not None:
+                self.intervals.append(t - self._last)
+            self._last = t
 
     def run (self, cb, args = (), frames = None, seconds = None):
         """Run indefinitely or for a specified amount of time.
@@ -88,18 +209,38 @@ seconds: number of seconds to run for; this can be a float, and is not wrapped
         if finite:
             frames = max(int(frames), 1)
         # main loop
-        t0 = time()
+        now = self._now
+        t0 = now()
+        skipped = 0
+        self.skipping = False
+        self._last = None
         while not finite or frames:
+            self._record()
             cb(*args)
             if self.stopped:
                 break
-            t = time()
+            frame = self.frame
+            t = now()
             dt = t0 + frame - t
             if dt > 0:
-                wait(int(1000 * dt))
+                self._delay(t, dt)
                 t0 = t + dt
+                skipped = 0
+                self.skipping = False
+            elif -dt >= frame and skipped < self.max_skip:
+                # a whole frame behind: catch up without waiting
+                t0 += frame
+                skipped += 1
+                self.skipping = True
             else:
-                t0 = t
+                if -dt >= frame or not self.max_skip:
+                    # too far behind: lose the time
+                    t0 = t
+                else:
+                    # carry the lateness over to the next frame
+                    t0 += frame
+                skipped = 0
+                self.skipping = False
             if finite:
                 frames -= 1
                 if frames == 0:
@@ -108,13 +249,14 @@ seconds: number of seconds to run for; this can be a float, and is not wrapped
 
     def step (self):
         """Step forwards one frame."""
-        t = time()
+        t = self._now()
         dt = self.t + self.frame - t
         if dt > 0:
-            wait(int(1000 * dt))
+            self._delay(t, dt)
             self.t = t + dt
         else:
             self.t = t
+        self._record()
 
     def stop (self):
         """Stop any current call to Timer.run."""
@@ -128,31 +270,52 @@ seconds: number of seconds to run for; this can be a float, and is not wrapped
         self.fps = int(round(fps))
         self.frame = 1. / fps
 
+    def set_precise (self, precise):
+        """Set whether to pace frames precisely (see the constructor).
+
+Times from the old and new clocks can't be compared, so this restarts step's
+timing from now.  Don't call it during Timer.run.
+
+"""
+        self.precise = precise
+        self.t = self._now()
+        self._last = None
+
 
 class Scheduler ():
     """Simple event scheduler.
 
     CONSTRUCTOR
 
-Scheduler(fps = 60)
+Scheduler(fps = 60, max_skip = 0, precise = False, record = 0)
 
-fps: frames per second to aim for.
+fps, max_skip, precise, record: as taken by Timer.
 
     METHODS
 
 run
 add_timeout
 rm_timeout
+pending
 
     ATTRIBUTES
 
 timer: Timer instance.  Use this to change the FPS or stop the scheduler.
+frame: the number of frames handled so far.
+
+Timeouts are kept in a heap ordered by the frame they're due on, so the cost of
+a frame depends only on the number of callbacks called in it.
 
 """
 
-    def __init__ (self, fps = 60):
-        self.timer = Timer(fps)
+    def __init__ (self, fps = 60, max_skip = 0, precise = False, record = 0):
+        self.timer = Timer(fps, max_skip, precise, record)
+        self.frame = 0
+        # {ID: [due frame, repeat frames, cb, args]}
         self._cbs = {}
+        # (due frame, ID); may contain entries for removed timeouts, which are
+        # skipped
+        self._heap = []
         self._max_id = 0
 
     def run (self, frames = None, seconds = None):
@@ -198,33 +361,58 @@ otherwise it is removed.
         elif repeat_frames is None:
             repeat_frames = frames
         repeat_frames = max(int(repeat_frames), 1)
-        self._cbs[self._max_id] = [frames, repeat_frames, cb, args]
+        i = self._max_id
         self._max_id += 1
+        due = self.frame + frames
         # ID is key in self._cbs
-        return self._max_id - 1
+        self._cbs[i] = [due, repeat_frames, cb, args]
+        heappush(self._heap, (due, i))
+        return i
 
     def rm_timeout (self, *ids):
         """Remove the timeouts with the given IDs."""
+        cbs = self._cbs
         for i in ids:
             try:
-                del self._cbs[i]
+                del cbs[i]
             except KeyError:
                 pass
+        # drop removed entries if they make up most of the heap; do it in
+        # place, since this may be called from a callback while _update holds
+        # a reference to the heap
+        heap = self._heap
+        if len(heap) > 2 * len(cbs) + 16:
+            heap[:] = [(data[0], i) for i, data in cbs.iteritems()]
+            heapify(heap)
+
+    def pending (self):
+        """List timeouts that haven't been removed.
+
+pending() -> timeouts
+
+timeouts: list of (frames, ID, cb) for each timeout, where frames is the number
+          of frames until it's next called; sorted by frames then ID.
+
+"""
+        n = self.frame
+        return sorted((due - n, i, cb)
+                      for i, (due, total, cb, args) in self._cbs.iteritems())
 
     def _update (self):
         """Handle callbacks this frame."""
-        rm = []
-        # cbs might add/remove cbs, so use items instead of iteritems
-        for i, (remain, total, cb, args) in self._cbs.items():
-            remain -= 1
-            if remain == 0:
-                # call callback
-                if cb(*args):
-                    self._cbs[i][0] = total
-                else:
-                    rm.append(i)
+        self.frame = n = self.frame + 1
+        cbs = self._cbs
+        heap = self._heap
+        # timeouts added by callbacks are due next frame at the earliest
+        while heap and heap[0][0] <= n:
+            due, i = heappop(heap)
+            data = cbs.get(i)
+            if data is None or data[0] != due:
+                # removed
+                continue
+            due, total, cb, args = data
+            if cb(*args) and i in cbs:
+                data[0] = n + total
+                heappush(heap, (data[0], i))
             else:
-                assert remain > 0
-                self._cbs[i][0] = remain
-        for i in rm:
-            del self._cbs[i]
\ No newline at end of file
+                cbs.pop(i, None)
\ No newline at end of file
@@ -0,0 +1,99 @@
+class Grid (object):
+    """A uniform grid spatial index for rects.
+
+    CONSTRUCTOR
+
+Grid(cell_size)
+
+cell_size: the width and height of each grid cell.
+
+    METHODS
+
+add
+remove
+query
+
+    ATTRIBUTES
+
+rects: {key: rect} dict of all indexed rects.
+
+"""
+
+    def __init__ (self, cell_size):
+        self.cell_size = cell_size
+        self.rects = {}
+        # {(i, j): keys}
+        self._cells = {}
+        # {key: (i0, j0, i1, j1)} inclusive cell ranges
+        self._ranges = {}
+
+    def _range (self, rect):
+        s = self.cell_size
+        x, y, w, h = rect
+        return (int(x // s), int(y // s), int((x + w) // s),
+                int((y + h) // s))
+
+    def _cells_in (self, rng):
+        i0, j0, i1, j1 = rng
+        for i in xrange(i0, i1 + 1):
+            for j in xrange(j0, j1 + 1):
+                yield (i, j)
+
+    def add (self, key, rect):
+        """Add a rect, or move it if its key is already indexed.
+
+add(key, rect)
+
+key: a hashable identifier for the rect.
+rect: the rect itself; anything like (left, top, width, height).
+
+"""
+        self.rects[key] = rect
+        rng = self._range(rect)
+        old = self._ranges.get(key)
+        if rng == old:
+            return
+        cells = self._cells
+        if old is not None:
+            for c in self._cells_in(old):
+                keys = cells[c]
+                keys.discard(key)
+                if not keys:
+                    del cells[c]
+        for c in self._cells_in(rng):
+            try:
+                cells[c].add(key)
+            except KeyError:
+                cells[c] = set((key,))
+        self._ranges[key] = rng
+
+    def remove (self, key):
+        """Remove the rect with the given key, if indexed."""
+        try:
+            rng = self._ranges.pop(key)
+        except KeyError:
+            return
+        del self.rects[key]
+        cells = self._cells
+        for c in self._cells_in(rng):
+            keys = cells[c]
+            keys.discard(key)
+            if not keys:
+                del cells[c]
+
+    def query (self, rect):
+        """Get the keys of rects that might intersect the given rect.
+
+query(rect) -> keys
+
+keys: a set of keys of all rects in grid cells that rect touches.
+
+"""
+        cells = self._cells
+        found = set()
+        for c in self._cells_in(self._range(rect)):
+            try:
+                found |= cells[c]
+            except KeyError:
+                pass
+        return found
@@ -1,5 +1,6 @@
-from math import cos, sin, pi, ceil
-from random import randint, random, expovariate, shuffle
+import os
+from math import ceil
+from random import Random, randint
 
 import pygame as pg
 from pygame import Rect
@@ -7,13 +8,35 @@ from ext import evthandler as eh
 
 from conf import conf
 from obj import Player, Star
+from grid import Grid
 from util import ir
 import ui
+import replay
+import particles
 
-random0 = lambda: 2 * random() - 1
+random0 = lambda rand: 2 * rand.random() - 1
 
+# input actions, as taken by Level.apply_input
+INPUT_LEFT = 1
+INPUT_RIGHT = 2
+INPUT_JUMP = 4 # jump key pressed
+INPUT_JUMP_HELD = 8 # jump key repeat
+INPUT_RESET = 16
+INPUT_SKIP = 32 # skip death animation
 
-def tile (screen, img, rect, ox = 0, oy = 0, full = None):
+# spatial grid key types; collisions are resolved in this order
+GRID_RECT = 0
+GRID_VRECT = 1
+GRID_ARECT = 2
+GRID_GOAL = 3
+GRID_CHECKPOINT = 4
+GRID_STAR = 5
+# whole rects and vrects, for window sweeps
+GRID_SOURCE_RECT = 6
+GRID_SOURCE_VRECT = 7
+
+
+def tile (screen, img, rect, ox = 0, oy = 0, full = None, blend = 0):
     # get offset
     if full is not None:
         ox += rect[0] - full[0]
@@ -32,14 +55,109 @@ def tile (screen, img, rect, ox = 0, oy = 0, full = None):
         while y < y1:
             this_oy = oy if y == y0 else 0
             h = min(i_h - this_oy, y1 - y)
-            screen.blit(img, (x, y), (this_ox, this_oy, w, h))
+            screen.blit(img, (x, y), (this_ox, this_oy, w, h), blend)
             y += h
         x += w
 
 
+class TileCache (object):
+    """A bounded cache of surfaces with an image tiled over them.
+
+    CONSTRUCTOR
+
+TileCache(limit)
+
+limit: the maximum total area of cached surfaces, in pixels.  The least
+       recently used surfaces are dropped to stay within this.
+
+    METHODS
+
+get
+clear
+
+"""
+
+    def __init__ (self, limit):
+        self.limit = limit
+        # {key: [surface, last used]}
+        self._sfcs = {}
+        self._area = 0
+        self._t = 0
+
+    def get (self, img, size, ox = 0, oy = 0):
+        """Get a surface with an image tiled over it.
+
+get(img, size, ox = 0, oy = 0) -> surface
+
+img: the image to tile.
+size: the size of the surface.
+ox, oy: offset of the tiling, as taken by tile.
+
+"""
+        i_w, i_h = img.get_size()
+        size = tuple(size)
+        key = (img, size, ox % i_w, oy % i_h)
+        self._t += 1
+        try:
+            item = self._sfcs[key]
+        except KeyError:
+            sfc = pg.Surface(size, img.get_flags(), img)
+            if img.get_flags() & pg.SRCALPHA:
+                # surface is transparent black: copy pixels exactly
+                tile(sfc, img, (0, 0) + size, ox, oy, blend = pg.BLEND_RGBA_ADD)
+            else:
+                tile(sfc, img, (0, 0) + size, ox, oy)
+            self._sfcs[key] = [sfc, self._t]
+            self._area += size[0] * size[1]
+            self._evict(key)
+            return sfc
+        else:
+            item[1] = self._t
+            return item[0]
+
+    def _evict (self, keep):
+        sfcs = self._sfcs
+        if self._area <= self.limit:
+            return
+        for t, key in sorted((item[1], key) for key, item in sfcs.iteritems()):
+            if key != keep:
+                w, h = key[1]
+                del sfcs[key]
+                self._area -= w * h
+                if self._area <= self.limit:
+                    break
+
+    def clear (self):
+        """Remove all cached surfaces."""
+        self._sfcs = {}
+        self._area = 0
+
+
+class MouseInput (object):
+    """Level input source that moves the window with the mouse.
+
+This is the default; any object with a window_delta method can be used instead
+by setting it as a level's input attribute.
+
+"""
+
+    def window_delta (self, level):
+        """Get the amount to move the window by this frame.
+
+window_delta(level) -> (dx, dy)
+
+"""
+        x0, y0 = level.centre
+        x, y = pg.mouse.get_pos()
+        pg.mouse.set_pos(x0, y0)
+        return (x - x0, y - y0)
+
+
 class Level (object):
-    def __init__ (self, game, event_handler = None, ID = 0, cp = -1):
+    def __init__ (self, game, event_handler = None, ID = 0, cp = -1,
+                  seed = None, save_progress = None):
         self.game = game
+        self.dirty = True
         # input
         if event_handler is not None:
             event_handler.add_event_handlers({
@@ -60,7 +178,20 @@ class Level (object):
         border = (2 * (ww + 5), 2 * (wh + 5))
         self.window_bds = pg.Rect(0, 0, w, h).inflate(border)
         self.clouds = []
+        self.inverse_pieces = [Rect(0, 0, 0, 0) for i in xrange(8)]
+        self.tile_cache = TileCache(conf.TILE_CACHE_SIZE)
+        # static parts of the level, prerendered when drawn at this size
+        self.layers_res = None
         self.load_graphics()
+        self.input = MouseInput()
+        self.swept_window = conf.SWEPT_WINDOW
+        # levels without input are only for display or simulation, by default
+        if save_progress is None:
+            save_progress = event_handler is not None
+        self.save_progress = save_progress
+        self.recorder = None
+        # input actions this frame, in the order they happened
+        self.frame_input = []
         if event_handler is not None:
             self.move_channel = game.move_channel
             self.star_channel = game.star_channel
@@ -69,16 +200,14 @@ class Level (object):
             self.star_channel = None
         # load first level
         self.ID = None
-        self.init(ID, cp)
+        self.init(ID, cp, seed)
 
-    def init (self, ID = None, cp = None):
+    def init (self, ID = None, cp = None, seed = None):
         self.paused = False
         self.dying = False
         self.first_dying = False
         self.winning = False
         self.fading = False
-        self.particles = []
-        self.particle_rects = []
         self.void_jitter = [conf.VOID_JITTER_X, conf.VOID_JITTER_Y, conf.VOID_JITTER_T]
         self.first = True
         # get level/current checkpoint
@@ -89,13 +218,23 @@ class Level (object):
             # new level
             self.ID = ID
             self.current_cp = cp if cp is not None else -1
+            # seed random numbers, so that the level can be replayed
+            if seed is None:
+                seed = randint(0, conf.MAX_SEED)
+            self.seed = seed
+            self.rand = rand = Random(seed)
+            # drawing might not happen every frame, so use separate numbers
+            self.draw_rand = Random(seed + 1)
+            self.particles = particles.new(rand)
+            self.layers_res = None
+            self.start_recording()
             # clouds: randomise initial positions and velocities
             self.clouds = cs = []
             w, h = conf.RES
             imgs = self.imgs
             vx0 = conf.CLOUD_SPEED
             vy0 = vx0 * conf.CLOUD_VERT_SPEED_RATIO
-            self.cloud_vel = [vx0 * random0(), vy0 * random0()]
+            self.cloud_vel = [vx0 * random0(rand), vy0 * random0(rand)]
             vx = conf.CLOUD_MOD_SPEED_RATIO
             vy = vx * conf.CLOUD_VERT_SPEED_RATIO
             for c in conf.CLOUDS:
@@ -103,11 +242,13 @@ class Level (object):
                 s = (c_w, c_h)
                 c_w /= 2
                 c_h /= 2
-                pos = [randint(-c_w, w - c_w), randint(-c_h, h - c_h)]
-                vel = [vx * random0(), vy * random0()]
+                pos = [rand.randint(-c_w, w - c_w),
+                       rand.randint(-c_h, h - c_h)]
+                vel = [vx * random0(rand), vy * random0(rand)]
                 cs.append((pos, vel, s))
         elif cp is not None:
             self.current_cp = cp
+        self.particles.clear()
         data = conf.LEVELS[ID]
         # background
         self.bgs = data.get('bgs', conf.DEFAULT_BGS)
@@ -135,20 +276,64 @@ class Level (object):
         # stars
         self.stars = [Star(self, p, [ID, i] in conf.STARS)
                       for i, p in enumerate(data.get('stars', []))]
+        # indices of stars that need redrawing; a set so it stays small if
+        # the level is updated without being drawn
+        self.changed_stars = set()
         if self.star_channel is not None and not all(s.got for s in self.stars):
             self.star_channel.unpause()
         # rects
         self.all_rects = [Rect(r) for r in data.get('rects', [])]
         self.all_vrects = [Rect(r) for r in data.get('vrects', [])]
         self.arects = [Rect(r) for r in data.get('arects', [])]
+        # spatial index: static things here, window clips in update_rects
+        self.grid = g = Grid(conf.GRID_CELL_SIZE)
+        self.clips = {}
+        self.clip_pool = {}
+        for i, r in enumerate(self.arects):
+            g.add((GRID_ARECT, i), r)
+        g.add((GRID_GOAL,), self.goal)
+        for i, r in enumerate(self.checkpoints):
+            g.add((GRID_CHECKPOINT, i), r)
+        for i, s in enumerate(self.stars):
+            g.add((GRID_STAR, i), s.rect)
+        for i, r in enumerate(self.all_rects):
+            g.add((GRID_SOURCE_RECT, i), r)
+        for i, r in enumerate(self.all_vrects):
+            g.add((GRID_SOURCE_VRECT, i), r)
         self.update_rects()
 
-    def skip (self, evt):
+    def start_recording (self):
+        self.stop_recording()
+        self.frame_input = []
+        if conf.RECORD_DIR is not None and self.save_progress:
+            fn = os.path.join(conf.RECORD_DIR, '{0}.replay'.format(self.ID))
+            try:
+                self.recorder = replay.Recorder(fn, self.ID, self.current_cp,
+                                                self.seed)
+            except IOError:
+                print 'warning: can\'t write to file: \'{0}\''.format(fn)
+
+    def stop_recording (self):
+        """Finish writing the recording in progress, if any."""
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def skip_death (self):
         if self.dying and self.dying_counter < conf.DIE_SKIP_THRESHOLD and \
-           not (evt.type == pg.KEYDOWN and evt.key in conf.KEYS_BACK) and \
            not self.winning:
+            self.frame_input.append(INPUT_SKIP)
             self.init()
-        elif conf.DEBUG and evt.type == pg.MOUSEBUTTONDOWN:
+            return True
+        else:
+            return False
+
+    def skip (self, evt):
+        back = evt.type == pg.KEYDOWN and evt.key in conf.KEYS_BACK
+        if not back and self.skip_death():
+            # skipped the death animation
+            return
+        if conf.DEBUG and evt.type == pg.MOUSEBUTTONDOWN:
             r = self.player.rect
             c = self.window.center
             print 'moving to', c
@@ -165,21 +350,44 @@ class Level (object):
         self.paused = True
 
     def reset (self, *args):
+        self.frame_input.append(INPUT_RESET)
         if not self.winning:
             self.init()
 
     def jump (self, key, mode, mods):
+        self.frame_input.append(INPUT_JUMP if mode == 0 else INPUT_JUMP_HELD)
         self.player.jump(mode == 0)
 
     def move (self, key, mode, mods, i):
+        self.frame_input.append(INPUT_RIGHT if i else INPUT_LEFT)
         self.player.move(i)
 
-    def update_window (self):
-        w = self.window
-        wp0 = w.topleft
-        wp1 = w.bottomright
+    def apply_input (self, actions):
+        # handle input given as a sequence of INPUT_* actions, making the same
+        # calls the event handler did
+        for action in actions:
+            if action == INPUT_SKIP:
+                self.skip_death()
+            elif action == INPUT_LEFT:
+                self.move(None, -1, 0, 0)
+            elif action == INPUT_RIGHT:
+                self.move(None, -1, 0, 1)
+            elif action == INPUT_JUMP:
+                self.jump(None, 0, 0)
+            elif action == INPUT_RESET:
+                self.reset()
+            elif action == INPUT_JUMP_HELD:
+                self.jump(None, 2, 0)
+
+    def window_pieces (self, w):
+        # get the 8 pieces of the screen around the window w as (index, rect)
+        # tuples, leaving out any that are empty
+        x, y, ww, wh = w
+        wp0 = (x, y)
+        wp1 = (x + ww, y + wh)
         s = conf.RES
-        self.inverse_win = rs = []
+        rs = []
+        j = 0
         for px in (0, 1, 2):
             for py in (0, 1, 2):
                 if px == py == 1:
@@ -195,7 +403,19 @@ class Level (object):
                         r[i] = wp1[i]
                         r[i + 2] = s[i] - wp1[i]
                 if r[2] > 0 and r[3] > 0:
-                    rs.append(Rect(r))
+                    rs.append((j, r))
+                j += 1
+        return rs
+
+    def update_window (self):
+        # inverse window, with persistent Rects updated in place
+        pieces = self.inverse_pieces
+        self.inverse_win = rs = []
+        for j, r in self.window_pieces(self.window):
+            piece = pieces[j]
+            piece.topleft = r[:2]
+            piece.size = r[2:]
+            rs.append((j, piece))
 
     def get_clip (self, r1, r2, err = 0):
         x01, y01, w, h = r1
@@ -208,31 +428,91 @@ class Level (object):
         if w > err and h > err:
             return (x0, y0, w, h)
 
-    def update_rects (self):
+    def set_clip (self, key, c):
+        # store a window clip in the grid, reusing its Rect
+        clips = self.clips
+        if c is None:
+            if key in clips:
+                del clips[key]
+                self.grid.remove(key)
+            return
+        r = clips.get(key)
+        if r is None:
+            pool = self.clip_pool
+            r = pool.get(key)
+            if r is None:
+                r = pool[key] = Rect(c)
+            else:
+                r.topleft = c[:2]
+                r.size = c[2:]
+            clips[key] = r
+        elif r == c:
+            return
+        else:
+            r.topleft = c[:2]
+            r.size = c[2:]
+        self.grid.add(key, r)
+
+    def sweep_candidates (self, area):
+        # get the rects and vrects whose clips might change while the window
+        # moves within the given area
+        rects = area.collidelistall(self.all_rects)
+        x0, y0, w, h = area
+        x1, y1 = x0 + w, y0 + h
+        vrects = [i for i, r in enumerate(self.all_vrects)
+                  if (r[0] <= x1 and r[0] + r[2] >= x0) or
+                     (r[1] <= y1 and r[1] + r[3] >= y0)]
+        return (rects, vrects)
+
+    def update_rects (self, candidates = None):
+        # candidates is as returned by sweep_candidates; if not given, update
+        # all clips
         self.update_window()
+        get_clip = self.get_clip
+        set_clip = self.set_clip
+        if candidates is None:
+            rects = xrange(len(self.all_rects))
+            vrects = xrange(len(self.all_vrects))
+        else:
+            rects, vrects = candidates
         # rects
-        self.rects = rects = []
-        self.draw_rects = draw = []
         w = self.window
-        for r in self.all_rects:
-            c = w.clip(r)
-            if c:
-                rects.append(c)
-                draw.append(r)
+        all_rects = self.all_rects
+        for i in rects:
+            set_clip((GRID_RECT, i), get_clip(w, all_rects[i]))
         # vrects
-        self.vrects = rects = []
-        ws = self.inverse_win
-        for r in self.all_vrects:
-            for w in ws:
-                c = w.clip(r)
-                if c:
-                    rects.append(c)
+        pieces = self.inverse_win
+        all_vrects = self.all_vrects
+        for i in vrects:
+            r = all_vrects[i]
+            j0 = 0
+            for j, w in pieces:
+                # pieces that don't exist have no clips
+                for j_empty in xrange(j0, j):
+                    set_clip((GRID_VRECT, i, j_empty), None)
+                set_clip((GRID_VRECT, i, j), get_clip(w, r))
+                j0 = j + 1
+            for j_empty in xrange(j0, 8):
+                set_clip((GRID_VRECT, i, j_empty), None)
+
+    def nearby_solids (self, rect, after = None):
+        # get sorted grid keys for rects we might collide with
+        return sorted(k for k in self.grid.query(rect)
+                      if k[0] < GRID_GOAL and (after is None or k > after))
 
     def handle_collisions (self):
         get_clip = self.get_clip
         p = self.player.rect
-        p0 = list(p)
-        for r in self.rects + self.vrects + self.arects:
+        rects = self.grid.rects
+        # same as checking every rect in order, but only nearby ones
+        keys = self.nearby_solids(p)
+        i = 0
+        tested = 0
+        while i < len(keys):
+            key = keys[i]
+            r = rects[key]
+            i += 1
+            tested += 1
             if get_clip(r, p):
                 r_x0, r_y0, w, h = r
                 r_x1, r_y1 = r_x0 + w, r_y0 + h
@@ -245,6 +525,9 @@ class Level (object):
                 self.player.impact(axis, 0)
                 if axis == 1:
                     self.vert_dirn = dirn
+                # player moved: look for rects near its new position
+                keys = self.nearby_solids(p, key)
+                i = 0
         # screen left/right
         if p[0] < 0:
             p[0] = 0
@@ -255,8 +538,9 @@ class Level (object):
         # die if still colliding
         axes = set()
         e = conf.ERR
-        colliding = [r for r in self.rects + self.vrects + self.arects \
-                     if get_clip(r, p, e)]
+        keys = self.nearby_solids(p)
+        self.game.telemetry.count('collisions', tested + len(keys))
+        colliding = [rects[k] for k in keys if get_clip(rects[k], p, e)]
         if colliding:
             for r in colliding:
                 r_x0, r_y0, w, h = r
@@ -272,6 +556,110 @@ class Level (object):
                 dirn = .95 if axes.pop() == 0 else .1
             self.die(dirn)
 
+    def step_window (self, dx, dy, candidates):
+        # move the window by WINDOW_MOVE_AMOUNT at a time, handling collisions
+        # after every step
+        w = self.window
+        c = conf.WINDOW_MOVE_AMOUNT
+        for axis, d in ((0, dx), (1, dy)):
+            dirn = 1 if d > 0 else -1
+            while d * dirn > 0:
+                d -= dirn * c
+                rel = [0, 0]
+                rel[axis] += c * dirn + (0 if d * dirn > 0 else d)
+                w.move_ip(rel)
+                self.update_rects(candidates)
+                if not self.dying:
+                    self.handle_collisions()
+
+    def sweep_window (self, dx, dy, candidates):
+        # does the same as step_window, but only stops at the steps where the
+        # player touches something
+        w = self.window
+        c = conf.WINDOW_MOVE_AMOUNT
+        for axis, d in ((0, dx), (1, dy)):
+            if d == 0:
+                continue
+            dirn = 1 if d > 0 else -1
+            d = abs(d)
+            n = (d + c - 1) // c
+            start = w[axis]
+            i = 0
+            while i < n and not self.dying:
+                i = self.first_impact(axis, start, dirn, d, i + 1, n)
+                if i is None:
+                    break
+                w[axis] = start + dirn * min(i * c, d)
+                self.update_rects(candidates)
+                self.handle_collisions()
+            # move the rest of the way
+            end = start + dirn * d
+            if w[axis] != end:
+                w[axis] = end
+                self.update_rects(candidates)
+
+    def first_impact (self, axis, start, dirn, d, i0, n):
+        # find the first window step in [i0, n] at which the player touches
+        # anything, or None; the window moves along axis from start by
+        # WINDOW_MOVE_AMOUNT at a time, up to a distance d in direction dirn
+        get_clip = self.get_clip
+        p = self.player.rect
+        if p[0] < 0 or p[0] + p[2] > conf.RES[0]:
+            # off the screen
+            return i0
+        # sources we might touch, clipped to the player
+        rects = []
+        vrects = []
+        for key in self.grid.query(p):
+            t = key[0]
+            if t == GRID_ARECT:
+                if get_clip(self.arects[key[1]], p):
+                    return i0
+            elif t == GRID_SOURCE_RECT:
+                b = get_clip(self.all_rects[key[1]], p)
+                if b:
+                    rects.append(b)
+            elif t == GRID_SOURCE_VRECT:
+                b = get_clip(self.all_vrects[key[1]], p)
+                if b:
+                    vrects.append(b)
+        if not rects and not vrects:
+            return None
+        # whether touching anything changes only when the window's edges pass
+        # those of the sources or the screen
+        ww = self.window[axis + 2]
+        s = conf.RES[axis]
+        crit = [0, s, -ww, s - ww]
+        for b in rects + vrects:
+            x0 = b[axis]
+            x1 = x0 + b[axis + 2]
+            crit += [x0, x1, x0 - ww, x1 - ww]
+        c = conf.WINDOW_MOVE_AMOUNT
+        steps = set((i0,))
+        for v in crit:
+            # first step at or past v, and first step past v
+            t = dirn * (v - start)
+            if t <= d:
+                steps.add(max(int(ceil(float(t) / c)), i0))
+            if t < d:
+                steps.add(max(int(t // c) + 1, i0))
+        # check window positions at these steps
+        w = list(self.window)
+        for i in sorted(steps):
+            if i > n:
+                break
+            w[axis] = start + dirn * min(i * c, d)
+            for b in rects:
+                if get_clip(w, b):
+                    return i
+            if vrects:
+                pieces = self.window_pieces(w)
+                for b in vrects:
+                    for j, r in pieces:
+                        if get_clip(r, b):
+                            return i
+        return None
+
     def die (self, dirn = .5):
         self.first_dying = True
         self.dying = True
@@ -291,6 +679,7 @@ class Level (object):
             if self.star_channel is not None:
                 self.star_channel.pause()
         i = self.ID
+        save = save and self.save_progress
         if not conf.COMPLETED and i + 1 in conf.EXISTS:
             # there's a next level
             if save:
@@ -301,19 +690,31 @@ class Level (object):
             if save:
                 conf.COMPLETED = True
             if progress:
+                self.stop_recording()
                 self.game.switch_backend(ui.LevelSelect)
 
     def win (self):
         if self.winning:
             return
         self.winning = True
+        # the recording is complete
+        self.stop_recording()
         self.next_level(progress = False)
-        if self.ID not in conf.COMPLETED_LEVELS:
-            conf.COMPLETED_LEVELS.append(self.ID)
-        conf.dump()
+        if self.save_progress:
+            if self.ID not in conf.COMPLETED_LEVELS:
+                conf.COMPLETED_LEVELS.append(self.ID)
+            conf.dump()
         self.start_fading(lambda: self.next_level(False))
 
     def update (self):
+        if self.recorder is not None:
+            # player position after this frame's input, for checking replays
+            self.recorder.trace(self.player.rect)
+        if not self.dying:
+            # position at the end of the last frame, for physics; this has to
+            # happen every frame whether or not the level is drawn
+            pl = self.player
+            pl.old_rect = list(pl.rect)
         # fade counter
         if self.fading:
             self.fade_counter -= 1
@@ -328,23 +729,28 @@ class Level (object):
         # get amount to move window by
         w = self.window
         self.old_window = w.copy()
-        x0, y0 = self.centre
-        if self.paused or self.first:
+        dx, dy = self.input.window_delta(self)
+        ignore = self.paused or self.first
+        if ignore:
             dx = dy = 0
             self.first = False
-        else:
-            x, y = pg.mouse.get_pos()
-            dx, dy = x - x0, y - y0
+        if self.recorder is not None:
+            self.recorder.frame(self.frame_input, (dx, dy))
+        self.frame_input = []
+        if not ignore:
             # don't move too far outside the screen
             w_moved = w.move(dx, dy).clamp(self.window_bds)
             dx, dy = w_moved[0] - w[0], w_moved[1] - w[1]
-        pg.mouse.set_pos(x0, y0)
         wx0, wy0, ww, wh = self.total_window = w.union(w.move(dx, dy))
+        if dx or dy:
+            # only these clips can change as the window moves
+            candidates = self.sweep_candidates(self.total_window)
         # move window
         if self.dying:
             # just move window
-            w.move_ip(dx, dy)
-            self.update_rects()
+            if dx or dy:
+                w.move_ip(dx, dy)
+                self.update_rects(candidates)
         else:
             self.vert_dirn = 3
             if dx == dy == 0:
@@ -360,21 +766,14 @@ class Level (object):
                 py1 = max(r[1] + r[3], o_r[1] + o_r[3])
                 if px1 > wx0 and py1 > wy0 and px0 < wx1 and py0 < wy1:
                     # if so, move window a few pixels at a time
-                    c = conf.WINDOW_MOVE_AMOUNT
-                    for axis, d in ((0, dx), (1, dy)):
-                        dirn = 1 if d > 0 else -1
-                        while d * dirn > 0:
-                            d -= dirn * c
-                            rel = [0, 0]
-                            rel[axis] += c * dirn + (0 if d * dirn > 0 else d)
-                            w.move_ip(rel)
-                            self.update_rects()
-                            if not self.dying:
-                                self.handle_collisions()
+                    if self.swept_window:
+                        self.sweep_window(dx, dy, candidates)
+                    else:
+                        self.step_window(dx, dy, candidates)
                 else:
                     # else move it the whole way
                     w.move_ip(dx, dy)
-                    self.update_rects()
+                    self.update_rects(candidates)
                     self.handle_collisions()
             if self.vert_dirn == 1:
                 pl.on_ground = conf.ON_GROUND_TIME
@@ -384,8 +783,8 @@ class Level (object):
             jx = conf.CLOUD_JITTER
             jy = jx * conf.CLOUD_VERT_SPEED_RATIO
             v0 = self.cloud_vel
-            v0[0] += jx * random0()
-            v0[1] += jy * random0()
+            v0[0] += jx * random0(self.rand)
+            v0[1] += jy * random0(self.rand)
             r = conf.RES
             for p, v, s in self.clouds:
                 for i, (i_w, r_w) in enumerate(zip(s, r)):
@@ -399,50 +798,12 @@ class Level (object):
                         x = -i_w
                     p[i] = x
         # particles
-        ptcls = []
-        rects = []
-        for k, j, group in self.particles:
-            g = []
-            x0, y0 = conf.RES
-            x1 = y1 = 0
-            for c, p, v, size, t in group:
-                x, y = p
-                # update boundary
-                if x < x0:
-                    x0 = x
-                if y < y0:
-                    y0 = y
-                if x + size > x1:
-                    x1 = x + size
-                if y + size > y1:
-                    y1 = y + size
-                t -= 1
-                if t != 0:
-                    # move
-                    vx, vy = v
-                    x += vx
-                    y += vy
-                    # update boundary
-                    if x < x0:
-                        x0 = x
-                    if y < y0:
-                        y0 = y
-                    if x + size > x1:
-                        x1 = x + size
-                    if y + size > y1:
-                        y1 = y + size
-                    # damp/jitter
-                    vx *= k
-                    vy *= k
-                    vx += j * random0()
-                    vy += j * random0()
-                    g.append((c, (x, y), (vx, vy), size, t))
-            if g:
-                ptcls.append((k, j, g))
-            if x1 > x0 and y1 > y0:
-                rects.append((int(x0), int(y0), ceil(x1 - x0), ceil(y1 - y0)))
-        self.particles = ptcls
-        self.particle_rects = rects
+        self.particles.update()
+        self.game.telemetry.set('particles', len(self.particles))
+        # stars
+        for i, s in enumerate(self.stars):
+            if not s.got and s.pulse():
+                self.changed_stars.add(i)
         # death counter
         if self.dying:
             self.dying_counter -= 1
@@ -454,24 +815,31 @@ class Level (object):
         # die if OoB
         if pl.rect[1] > conf.RES[1]:
             self.die()
-        # win if at goal
         p = pl.rect
-        c = w.clip(self.goal)
-        if c and self.get_clip(p, c):
-            self.win()
+        near = self.grid.query(p)
+        # win if at goal
+        if (GRID_GOAL,) in near:
+            c = w.clip(self.goal)
+            if c and self.get_clip(p, c):
+                self.win()
         # check if at checkpoints
-        for c in self.checkpoints[self.current_cp + 1:]:
-            if w.clip(c) and self.get_clip(p, c):
+        i0 = self.current_cp + 1
+        for i, c in enumerate(self.checkpoints[i0:], i0):
+            if (GRID_CHECKPOINT, i) in near and w.clip(c) and \
+               self.get_clip(p, c):
                 self.current_cp += 1
         # check if at stars
         for i, s in enumerate(self.stars):
-            if not s.got and w.clip(s.rect) and self.get_clip(p, s.rect):
+            if not s.got and (GRID_STAR, i) in near and w.clip(s.rect) and \
+               self.get_clip(p, s.rect):
                 #self.game.play_snd('collectstar')
                 if self.star_channel is not None and all(s.got for s in self.stars):
                     self.star_channel.pause()
                 s.got = True
-                conf.STARS.append([self.ID, i])
-                conf.dump()
+                self.changed_stars.add(i)
+                if self.save_progress:
+                    conf.STARS.append([self.ID, i])
+                    conf.dump()
 
     def load_graphics (self):
         self.imgs = imgs = {}
@@ -485,27 +853,7 @@ class Level (object):
         return [ir(x) for x in rect]
 
     def add_ptcls (self, key, pos, dirn = .5):
-        particles = []
-        data = conf.PARTICLES[key]
-        max_speed = data['speed']
-        max_size = data['size']
-        k = data['damping']
-        j = data['jitter']
-        max_life = data['life']
-        dirn *= pi / 2
-        for c, amount in data['colours']:
-            a, b = divmod(amount, 1)
-            amount = int(a) + (1 if random() < b else 0)
-            while amount > 0:
-                size = randint(1, max_size)
-                amount -= size
-                angle = random() * 2 * pi
-                speed = max_speed * expovariate(5)
-                v = (speed * cos(dirn) * cos(angle), speed * sin(dirn) * sin(angle))
-                life = int(random() * max_life)
-                if life > 0:
-                    particles.append((c, tuple(pos), v, size, life))
-        self.particles.append((k, j, particles))
+        self.particles.add(conf.PARTICLES[key], pos, dirn)
 
     def start_fading (self, cb):
         if not self.fading:
@@ -518,17 +866,74 @@ class Level (object):
         if len(jitter) == 3:
             jx, jy, t0 = jitter
             t = t0
+            randint = self.draw_rand.randint
             ox, oy = randint(0, jx), randint(0, jy)
             jitter += [ox, oy, t]
         else:
             jx, jy, t0, ox, oy, t = jitter
             if t == 0:
+                randint = self.draw_rand.randint
                 ox, oy = randint(0, jx), randint(0, jy)
                 jitter[3] = ox
                 jitter[4] = oy
                 jitter[5] = t0
         jitter[5] -= 1
 
+    def refresh_display (self):
+        self.layers_res = None
+
+    def build_layers (self, res):
+        """Prerender the parts of the level that don't change.
+
+build_layers(res)
+
+res: the screen size to render for.
+
+Sets the void_layer (background), lower_layer (vrects), upper_layer (arects and
+goal) and bg_layer (window background images) attributes.  lower_layer and
+upper_layer are the size of the screen; void_layer is larger by the maximum
+jitter, to be drawn from with the current jitter offset; bg_layer covers
+bg_layer_rect.  Also clears the tile cache.
+
+"""
+        imgs = self.imgs
+        self.tile_cache.clear()
+        # void
+        w, h = res
+        size = (w + conf.VOID_JITTER_X, h + conf.VOID_JITTER_Y)
+        self.void_layer = sfc = pg.Surface(size).convert()
+        tile(sfc, imgs['void'], (0, 0) + size)
+        # lower
+        self.lower_layer = sfc = pg.Surface(res).convert_alpha()
+        sfc.fill((0, 0, 0, 0))
+        img = imgs['vrect']
+        for r in self.all_vrects:
+            tile(sfc, img, r)
+        # upper
+        self.upper_layer = sfc = pg.Surface(res).convert_alpha()
+        sfc.fill((0, 0, 0, 0))
+        img = imgs['arect']
+        for r in self.arects:
+            tile(sfc, img, r)
+        sfc.blit(imgs['goal'], self.goal_img)
+        # window background
+        bgs = []
+        for img in self.bgs:
+            if isinstance(img, str):
+                pos = (0, 0)
+            else:
+                img, pos = img
+            bgs.append((imgs[img], Rect(pos, imgs[img].get_size())))
+        self.bg_layer_rect = bounds = bgs[0][1].unionall([r for i, r in bgs])
+        self.bg_layer = sfc = pg.Surface(bounds.size).convert_alpha()
+        sfc.fill((0, 0, 0, 0))
+        offset = (-bounds[0], -bounds[1])
+        for i, (img, r) in enumerate(bgs):
+            # copy the first image exactly, including transparency
+            sfc.blit(img, r.move(offset), None,
+                     0 if i else pg.BLEND_RGBA_ADD)
+        self.layers_res = res
+
     def draw (self, screen):
         # don't draw on last frame
         #if not self.game.running:
@@ -541,39 +946,52 @@ class Level (object):
         jitter = self.void_jitter
         self.update_jitter(jitter)
         ox, oy = jitter[3], jitter[4]
-        img = imgs['void']
-        draw_all = jitter[5] == conf.VOID_JITTER_T - 1 or self.fading or self.paused
+        res = screen.get_size()
+        if res != self.layers_res:
+            self.build_layers(res)
+        void = self.void_layer
+        # dirty is set by the game when everything needs redrawing, such as
+        # after frames were skipped
+        draw_all = jitter[5] == conf.VOID_JITTER_T - 1 or self.fading or \
+                   self.paused or self.dirty
         if self.paused:
             self.paused = False
+        self.dirty = False
         if draw_all:
-            tile(screen, img, (0, 0) + screen.get_size(), ox, oy)
+            draw_rects = [Rect((0, 0), res)]
         else:
-            draw_rects = self.particle_rects + [self.total_window, self.goal_img]
+            draw_rects = self.particles.rects + \
+                         [self.stars[i].rect for i in self.changed_stars] + \
+                         [self.total_window, self.goal_img]
             if self.first_dying or not self.dying:
                 draw_rects.append(pl.rect_img.union(pl.old_rect_img))
-            for r in draw_rects:
-                tile(screen, img, r, ox, oy, (0, 0))
-        # vrects
-        img = imgs['vrect']
-        for r in self.all_vrects:
-            tile(screen, img, r)
+            # redraw the whole of any star that gets drawn over
+            draw_rects += [s.rect for s in self.stars if not s.got and
+                           s.rect.collidelist(draw_rects) != -1]
+        self.changed_stars.clear()
+        # void, vrects
+        lower = self.lower_layer
+        for r in draw_rects:
+            screen.blit(void, r, Rect(r).move(ox, oy))
+            screen.blit(lower, r, r)
         # window
         offset = (-w[0], -w[1])
         w_sfc = self.window_sfc
-        # window background: static images
-        for img in self.bgs:
-            if isinstance(img, str):
-                pos = (0, 0)
-            else:
-                img, pos = img
-            w_sfc.blit(imgs[img], Rect(pos + (0, 0)).move(offset))
+        # window background
+        bounds = self.bg_layer_rect
+        w_sfc.blit(self.bg_layer, bounds.move(offset))
         # clouds
         for c, (p, v, s) in zip(conf.CLOUDS, self.clouds):
             w_sfc.blit(imgs[c], Rect(self.to_screen(p + [0, 0])).move(offset))
         # rects in window
         img = imgs['rect']
-        for r, r_full in zip(self.rects, self.draw_rects):
-            tile(w_sfc, img, r.move(offset), full = r_full.move(offset))
+        cache = self.tile_cache
+        clips = self.clips
+        all_rects = self.all_rects
+        for key in sorted(k for k in clips if k[0] == GRID_RECT):
+            r, r_full = clips[key], all_rects[key[1]]
+            w_sfc.blit(cache.get(img, r_full.size), r.move(offset),
+                       r.move(-r_full[0], -r_full[1]))
         # checkpoints
         for i, r in enumerate(self.checkpoints):
             img = imgs['checkpoint' + ('-current' if i == self.current_cp else '')]
@@ -582,23 +1000,19 @@ class Level (object):
         w_sfc.blit(imgs['window'], (0, 0), None, pg.BLEND_RGBA_MULT)
         # copy window area to screen
         screen.blit(w_sfc, w)
-        # arects
-        img = imgs['arect']
-        for r in self.arects:
-            tile(screen, img, r)
-        # goal
-        screen.blit(imgs['goal'], self.goal_img)
+        # arects, goal
+        upper = self.upper_layer
+        for r in draw_rects:
+            screen.blit(upper, r, r)
         # stars
         for s in self.stars:
-            if not s.got:
+            if not s.got and (draw_all or s.rect.collidelist(draw_rects) != -1):
                 s.draw(screen, (0, 0))
         # player
         if not self.dying:
             pl.draw(screen)
         # particles
-        for k, j, g in self.particles:
-            for c, p, v, size, t in g:
-                screen.fill(c, p + (size, size))
+        self.particles.draw(screen)
         # fadeout
         if self.fading:
             t = conf.FADE_TIME - self.fade_counter
@@ -612,4 +1026,4 @@ class Level (object):
         if draw_all:
             return True
         else:
-            return draw_rects + self.arects
+            return draw_rects
@@ -1,5 +1,3 @@
-from random import expovariate
-
 import pygame as pg
 from pygame import Rect
 
@@ -7,9 +5,115 @@ from conf import conf
 from util import ir
 
 
+class PlayerFrames (object):
+    """Composed player frames, and a bounded cache of scaled versions.
+
+    CONSTRUCTOR
+
+PlayerFrames(limit)
+
+limit: the maximum number of scaled frames to keep; the least recently used
+       are dropped.
+
+    METHODS
+
+load
+get
+
+    ATTRIBUTES
+
+atlas: a surface containing every frame, or None if not loaded yet.
+frames: {(skew, dirn, blinking): frame} subsurfaces of atlas.
+
+"""
+
+    def __init__ (self, limit):
+        self.limit = limit
+        self.atlas = None
+        self.frames = {}
+        self._src = None
+        # {(frame key, size): [surface, last used]}
+        self._scaled = {}
+        self._t = 0
+
+    def load (self, game):
+        """Compose every frame from the game's images, if not already done.
+
+Frames are composed again if the game's player image has changed, as it does
+with a new Game instance.
+
+"""
+        img = game.img('player.png')
+        if img is self._src:
+            return
+        max_skew = conf.PLAYER_MAX_SKEW
+        w, h = img.get_size()
+        w0, h0 = size = (w / (max_skew + 1), h / 2)
+        f_imgs = [game.img('player-features.png'),
+                  game.img('player-features-blinking.png')]
+        f_imgs = [(f_img, pg.transform.flip(f_img, True, False))
+                  for f_img in f_imgs]
+        # one row per (dirn, blinking), one column per skew
+        n_skews = 2 * max_skew + 1
+        self.atlas = atlas = pg.Surface((w0 * n_skews, h0 * 4)).convert_alpha()
+        atlas.fill((0, 0, 0, 0))
+        self.frames = frames = {}
+        for i, skew in enumerate(xrange(-max_skew, max_skew + 1)):
+            for j, (dirn, blinking) in enumerate(((False, False),
+                                                  (False, True),
+                                                  (True, False),
+                                                  (True, True))):
+                sfc = atlas.subsurface(((w0 * i, h0 * j), size))
+                x0, y0 = w0 * abs(skew), h0 if skew > 0 else 0
+                sfc.blit(img, (0, 0), (x0, y0, w0, h0))
+                f_img = f_imgs[blinking][dirn]
+                if dirn:
+                    # facing right
+                    x0 = w0 * (max_skew - abs(skew))
+                    # use opposite skew
+                    y0 = 0 if skew > 0 else h0
+                sfc.blit(f_img, (0, 0), (x0, y0, w0, h0))
+                frames[(skew, dirn, blinking)] = sfc
+        self._src = img
+        self._scaled = {}
+
+    def get (self, key, size):
+        """Get a frame scaled to the given size.
+
+get(key, size) -> surface
+
+key: the frame's (skew, dirn, blinking) key in the frames attribute.
+size: (width, height) to scale to.
+
+"""
+        self._t += 1
+        k = (key, size)
+        scaled = self._scaled
+        try:
+            item = scaled[k]
+        except KeyError:
+            frame = self.frames[key]
+            if size == frame.get_size():
+                sfc = frame
+            else:
+                sfc = pg.transform.smoothscale(frame, size)
+            if len(scaled) >= self.limit:
+                del scaled[min(scaled, key = lambda x: scaled[x][1])]
+            scaled[k] = [sfc, self._t]
+            return sfc
+        else:
+            item[1] = self._t
+            return item[0]
+
+
+# shared by all players
+player_frames = PlayerFrames(conf.PLAYER_FRAME_CACHE_SIZE)
+
+
 class Player (object):
     def __init__ (self, level, pos):
         self.level = level
+        player_frames.load(level.game)
         w, h = level.game.img('player.png').get_size()
         self.img_size = (w / (conf.PLAYER_MAX_SKEW + 1), h / 2)
         self.rect = list(pos) + list(conf.PLAYER_SIZE)
@@ -27,22 +131,13 @@ class Player (object):
         self.moved = False
         if level.move_channel is not None:
             level.move_channel.pause()
-        self.img = level.game.img('player.png')
-        self.f_imgs = [level.game.img('player-features.png'),
-                       level.game.img('player-features-blinking.png')]
-        self.f_imgs = [(img, pg.transform.flip(img, True, False))
-                       for img in self.f_imgs]
-        self.sfc = pg.Surface(self.img_size).convert_alpha()
         self.dirn = True
-        self.last_dirn = None
         self.skew_v = 0
         self.skew = 0
-        self.last_skew = None
         self.squash_v = [0, 0, 0, 0]
         self.squash = [0, 0, 0, 0]
-        self.last_scale = None
         self.blinking = -1
-        self.last_blinking = None
+        self.frame = None
         self.to_move = 0
 
     def impact (self, axis, v = None, dv = None):
@@ -149,6 +244,7 @@ class Player (object):
         # blink (< 0 means blinking, > 0 not)
         b = self.blinking
         if b in (1, -1):
+            expovariate = self.level.rand.expovariate
             b = -b * (2 + int(expovariate(.3 if b == 1 else .002)))
         else:
             b -= 1 if b > 0 else -1
@@ -158,28 +254,10 @@ class Player (object):
         ox, oy = conf.PLAYER_OFFSET
         x, y = (ir(self.rect[0]) + ox, ir(self.rect[1]) + oy)
         w0, h0 = self.img_size
-        # copy images to use to sfc
-        sfc = self.sfc
-        dirn = self.dirn
+        # choose frame
         skew = ir(self.skew)
         skew = (1 if skew > 0 else -1) * min(abs(skew), conf.PLAYER_MAX_SKEW)
-        blinking = self.blinking
-        if skew != self.last_skew or dirn != self.last_dirn \
-           or (blinking < 0) != self.last_blinking:
-            sfc.fill((0, 0, 0, 0))
-            x0, y0 = w0 * abs(skew), h0 if skew > 0 else 0
-            sfc.blit(self.img, (0, 0), (x0, y0, w0, h0))
-            f_img = self.f_imgs[blinking < 0][dirn]
-            if dirn:
-                # facing right
-                x0 = w0 * (conf.PLAYER_MAX_SKEW - abs(skew))
-                # use opposite skew
-                y0 = 0 if skew > 0 else h0
-            sfc.blit(f_img, (0, 0), (x0, y0, w0, h0))
-            self.last_scale = None
-            self.last_skew = skew
-            self.last_dirn = dirn
-            self.last_blinking = blinking < 0
+        self.frame = (skew, bool(self.dirn), self.blinking < 0)
         # scale
         x0, y0, x1, y1 = self.squash
         w = w0 - x0 - x1
@@ -220,36 +298,56 @@ class Player (object):
 
     def draw (self, screen):
         x, y, w, h = self.rect_img
-        if self.last_scale == (w, h):
-            sfc = self.last_sfc
-        else:
-            self.last_scale = (w, h)
-            self.last_sfc = sfc = pg.transform.smoothscale(self.sfc, (w, h))
-        screen.blit(sfc, (x, y))
-        self.old_rect = list(self.rect)
+        screen.blit(player_frames.get(self.frame, (w, h)), (x, y))
+        # where the player is on the screen, to erase next time
         self.old_rect_img = self.rect_img
 
 
+# {foreground image: frames}
+_glow_frames = {}
+
+
+def glow_frames (fg):
+    """Get the star foreground image at each glow level.
+
+glow_frames(fg) -> frames
+
+fg: the foreground image.
+
+frames: list of conf.STAR_GLOW_FRAMES surfaces, from transparent to fully
+        opaque.  These are created once for each image and shared.
+
+"""
+    try:
+        return _glow_frames[fg]
+    except KeyError:
+        pass
+    frames = []
+    n = conf.STAR_GLOW_FRAMES
+    for i in xrange(n):
+        sfc = pg.Surface(fg.get_size()).convert_alpha()
+        sfc.fill((255, 255, 255, ir(255. * i / (n - 1))))
+        sfc.blit(fg, (0, 0), None, pg.BLEND_RGBA_MULT)
+        frames.append(sfc)
+    # drop frames for old images
+    _glow_frames.clear()
+    _glow_frames[fg] = frames
+    return frames
+
+
 class Star (object):
     def __init__ (self, level, pos, got):
         self.rect = Rect(pos, conf.STAR_SIZE)
         self.got = got
         self.bg = level.game.img('star-bg.png')
-        self.fg = level.game.img('star-fg.png')
-        self.sfc = pg.Surface(self.fg.get_size()).convert_alpha()
+        self.frames = glow_frames(level.game.img('star-fg.png'))
         self.glow = 0
         self.glow_dirn = 1
+        self.frame = 0
 
-    def draw (self, screen, offset):
-        r = self.rect.move(offset)
-        screen.blit(self.bg, r)
-        sfc = self.sfc
+    def pulse (self):
+        """Update glow; returns whether the frame to draw changed."""
         g = self.glow
-        # draw fg with opacity level from glow
-        sfc.fill((255, 255, 255, ir(g * 255)))
-        sfc.blit(self.fg, (0, 0), None, pg.BLEND_RGBA_MULT)
-        screen.blit(sfc, r)
-        # update glow
         d = self.glow_dirn
         g += d * conf.STAR_PULSE_SPEED
         gb = min(1, max(0, g))
@@ -257,3 +355,12 @@ class Star (object):
             d *= -1
         self.glow = gb
         self.glow_dirn = d
+        frame = ir(gb * (len(self.frames) - 1))
+        changed = frame != self.frame
+        self.frame = frame
+        return changed
+
+    def draw (self, screen, offset):
+        r = self.rect.move(offset)
+        screen.blit(self.bg, r)
+        screen.blit(self.frames[self.frame], r)
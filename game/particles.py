@@ -0,0 +1,296 @@
+"""Particle systems.
+
+ArrayParticles stores particles in NumPy arrays and draws them through
+pygame.surfarray; Particles is a pure Python fallback used if NumPy isn't
+available.  Create one with new.
+
+"""
+
+from math import cos, sin, pi, ceil
+from random import Random
+
+try:
+    import numpy as np
+    from pygame import surfarray
+except ImportError:
+    np = None
+
+from conf import conf
+
+
+def new (rand):
+    """Create the best available particle system.
+
+new(rand) -> particles
+
+rand: random.Random instance to seed the particle system from.
+
+"""
+    if np is None:
+        return Particles(rand)
+    else:
+        return ArrayParticles(rand)
+
+
+class Particles (object):
+    """Particle system; all particle systems have this interface.
+
+    CONSTRUCTOR
+
+Particles(rand)
+
+rand: random.Random instance to seed the particles' own random numbers from.
+      Every particle system takes exactly one number from it, so the rest of
+      its sequence doesn't depend on whether NumPy is available (which would
+      break replays).
+
+    METHODS
+
+add
+clear
+update
+draw
+
+    ATTRIBUTES
+
+rects: rects covering the particles' positions before and after the last call
+       to update, to redraw the display in.
+
+len() gives the number of live particles.
+
+"""
+
+    def __init__ (self, rand):
+        self.rand = Random(rand.randint(0, 2 ** 32 - 1))
+        # list of (damping, jitter, particles) for each burst, where particles
+        # is a list of (colour, pos, vel, size, life)
+        self.groups = []
+        self.rects = []
+
+    def __len__ (self):
+        return sum(len(g) for k, j, g in self.groups)
+
+    def add (self, data, pos, dirn = .5):
+        """Add a burst of particles.
+
+add(data, pos, dirn = .5)
+
+data: the particle type definition, as found in conf.PARTICLES.
+pos: the position to emit the particles from.
+dirn: direction to emit the particles in, from 0 for horizontal to 1 for
+      vertical.
+
+"""
+        particles = []
+        max_speed = data['speed']
+        max_size = data['size']
+        max_life = data['life']
+        rand = self.rand
+        random, randint = rand.random, rand.randint
+        dirn *= pi / 2
+        for c, amount in data['colours']:
+            a, b = divmod(amount, 1)
+            amount = int(a) + (1 if random() < b else 0)
+            while amount > 0:
+                size = randint(1, max_size)
+                amount -= size
+                angle = random() * 2 * pi
+                speed = max_speed * rand.expovariate(5)
+                v = (speed * cos(dirn) * cos(angle), speed * sin(dirn) * sin(angle))
+                life = int(random() * max_life)
+                if life > 0:
+                    particles.append((c, tuple(pos), v, size, life))
+        self.groups.append((data['damping'], data['jitter'], particles))
+
+    def clear (self):
+        """Remove all particles."""
+        self.groups = []
+        self.rects = []
+
+    def update (self):
+        """Move particles and remove dead ones."""
+        ptcls = []
+        rects = []
+        random = self.rand.random
+        for k, j, group in self.groups:
+            g = []
+            x0, y0 = conf.RES
+            x1 = y1 = 0
+            for c, p, v, size, t in group:
+                x, y = p
+                # update boundary
+                if x < x0:
+                    x0 = x
+                if y < y0:
+                    y0 = y
+                if x + size > x1:
+                    x1 = x + size
+                if y + size > y1:
+                    y1 = y + size
+                t -= 1
+                if t != 0:
+                    # move
+                    vx, vy = v
+                    x += vx
+                    y += vy
+                    # update boundary
+                    if x < x0:
+                        x0 = x
+                    if y < y0:
+                        y0 = y
+                    if x + size > x1:
+                        x1 = x + size
+                    if y + size > y1:
+                        y1 = y + size
+                    # damp/jitter
+                    vx *= k
+                    vy *= k
+                    vx += j * (2 * random() - 1)
+                    vy += j * (2 * random() - 1)
+                    g.append((c, (x, y), (vx, vy), size, t))
+            if g:
+                ptcls.append((k, j, g))
+            if x1 > x0 and y1 > y0:
+                rects.append((int(x0), int(y0), ceil(x1 - x0), ceil(y1 - y0)))
+        self.groups = ptcls
+        self.rects = rects
+
+    def draw (self, screen):
+        """Draw particles to the given surface."""
+        for k, j, g in self.groups:
+            for c, p, v, size, t in g:
+                screen.fill(c, p + (size, size))
+
+
+class ArrayParticles (Particles):
+    """Particle system using NumPy arrays; Particles subclass.
+
+Takes the same arguments as Particles.
+
+"""
+
+    def __init__ (self, rand):
+        # for vectorised random numbers
+        self._rs = np.random.RandomState(rand.randint(0, 2 ** 32 - 1))
+        self.clear()
+
+    def _empty (self):
+        return (np.zeros((0, 2)), np.zeros((0, 2)), np.zeros(0, int),
+                np.zeros(0, int), np.zeros((0, 3), np.uint8), np.zeros(0),
+                np.zeros(0), np.zeros(0, int))
+
+    def clear (self):
+        self._next_group = 0
+        self._set(*self._empty())
+        self.rects = []
+
+    def _set (self, pos, vel, size, life, colour, damping, jitter, group):
+        self._pos = pos
+        self._vel = vel
+        self._size = size
+        self._life = life
+        self._colour = colour
+        self._damping = damping
+        self._jitter = jitter
+        # burst index for each particle; non-decreasing
+        self._group = group
+
+    def _arrays (self):
+        return (self._pos, self._vel, self._size, self._life, self._colour,
+                self._damping, self._jitter, self._group)
+
+    def __len__ (self):
+        return len(self._life)
+
+    def add (self, data, pos, dirn = .5):
+        rs = self._rs
+        max_speed = data['speed']
+        max_size = data['size']
+        max_life = data['life']
+        dirn *= pi / 2
+        blocks = [self._arrays()]
+        for c, amount in data['colours']:
+            a, b = divmod(amount, 1)
+            amount = int(a) + (1 if rs.random_sample() < b else 0)
+            if amount <= 0:
+                continue
+            # keep adding particles until their sizes make up the amount
+            size = rs.randint(1, max_size + 1, amount)
+            n = np.searchsorted(np.cumsum(size), amount) + 1
+            size = size[:n]
+            angle = rs.random_sample(n) * 2 * pi
+            speed = max_speed * rs.exponential(.2, n)
+            vel = np.column_stack((speed * cos(dirn) * np.cos(angle),
+                                   speed * sin(dirn) * np.sin(angle)))
+            life = (rs.random_sample(n) * max_life).astype(int)
+            keep = life > 0
+            n = int(keep.sum())
+            blocks.append((
+                np.tile(np.array(pos, float), (n, 1)), vel[keep], size[keep],
+                life[keep], np.tile(np.array(c, np.uint8), (n, 1)),
+                np.repeat(float(data['damping']), n),
+                np.repeat(float(data['jitter']), n),
+                np.repeat(self._next_group, n)
+            ))
+        self._next_group += 1
+        self._set(*(np.concatenate(arrays) for arrays in zip(*blocks)))
+
+    def update (self):
+        pos = self._pos
+        n = len(pos)
+        if n == 0:
+            self.rects = []
+            return
+        vel = self._vel
+        size = self._size[:, np.newaxis]
+        life = self._life - 1
+        alive = life != 0
+        # move, and get bounds before and after moving
+        new_pos = pos + vel
+        moved = np.where(alive[:, np.newaxis], new_pos, pos)
+        lo = np.minimum(pos, moved)
+        hi = np.maximum(pos, moved) + size
+        # bounds for each burst
+        group = self._group
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(group)) + 1))
+        lo = np.minimum(np.minimum.reduceat(lo, starts), conf.RES)
+        hi = np.maximum(np.maximum.reduceat(hi, starts), 0)
+        wh = np.ceil(hi - lo)
+        lo = lo.astype(int)
+        self.rects = [(x, y, w, h) for (x, y), (w, h)
+                      in zip(lo.tolist(), wh.tolist()) if w > 0 and h > 0]
+        # damp/jitter
+        damping = self._damping[:, np.newaxis]
+        jitter = self._jitter[:, np.newaxis]
+        vel = vel * damping + jitter * (2 * self._rs.random_sample((n, 2)) - 1)
+        # remove dead particles
+        self._set(new_pos[alive], vel[alive], self._size[alive], life[alive],
+                  self._colour[alive], self._damping[alive],
+                  self._jitter[alive], group[alive])
+
+    def draw (self, screen):
+        n = len(self._life)
+        if n == 0:
+            return
+        try:
+            pixels = surfarray.pixels3d(screen)
+        except ValueError:
+            # unsupported pixel format
+            for p, size, c in zip(self._pos.tolist(), self._size.tolist(),
+                                  self._colour.tolist()):
+                screen.fill(c, p + [size, size])
+            return
+        w, h = screen.get_size()
+        xy = self._pos.astype(int)
+        x, y = xy[:, 0], xy[:, 1]
+        size = self._size
+        colour = self._colour
+        # draw each pixel offset within the largest particle
+        for dx in xrange(int(size.max())):
+            for dy in xrange(int(size.max())):
+                px = x + dx
+                py = y + dy
+                draw = (size > max(dx, dy)) & (px >= 0) & (px < w) & \
+                       (py >= 0) & (py < h)
+                pixels[px[draw], py[draw]] = colour[draw]
+        del pixels
@@ -0,0 +1,128 @@
+"""Headless profiling of levels, run through game.py's --profile-levels option.
+
+Each level is profiled separately and back to back, and the results are kept so
+that runs can be compared.
+
+"""
+
+import os
+from time import time, strftime
+from cProfile import Profile
+from pstats import Stats
+
+from conf import conf
+from replay import simulate_level
+
+
+def parse_levels (s):
+    """Parse a list of levels to profile.
+
+parse_levels(s) -> IDs
+
+s: 'all', or a comma-separated list of level IDs.
+
+IDs: list of level IDs, or None if s is invalid.
+
+"""
+    n = len(conf.LEVELS)
+    if s == 'all':
+        return range(n)
+    try:
+        IDs = [int(ID) for ID in s.split(',')]
+    except ValueError:
+        return None
+    if not IDs or any(ID < 0 or ID >= n for ID in IDs):
+        return None
+    return IDs
+
+
+def _write_summary (fn, stats_fns, header, options):
+    """Write a top-N summary of the given stats files to a text file."""
+    try:
+        with open(fn, 'w') as f:
+            f.write(header + '\n')
+            s = Stats(*stats_fns, stream = f)
+            s.strip_dirs().sort_stats(options.sort_stats)
+            s.print_stats(options.num_stats)
+    except IOError:
+        print 'warning: can\'t write to file: \'{0}\''.format(fn)
+
+
+def profile_level (game, ID, frames, replay_dir = conf.REPLAY_DIR):
+    """Profile playing a level.
+
+profile_level(game, ID, frames, replay_dir = conf.REPLAY_DIR)
+    -> (profile, n, t, replayed)
+
+game: the running Game instance.
+ID: the level's ID.
+frames: the number of frames to leave the level idle for if there's no
+        recording for it.
+replay_dir: the directory to look for a recording in.
+
+profile: the cProfile.Profile instance, covering updating, drawing and updating
+         the display only.
+n: the number of frames played.
+t: the time spent, in seconds (including profiling overhead).
+replayed: whether the level was replayed from a recording.
+
+"""
+    screen = game.screen
+    dirty = game.dirty
+
+    def draw (l):
+        dirty.add(l.draw(screen))
+
+    sim, replayed = simulate_level(game, replay_dir, ID, frames, draw = draw)
+    step = sim.step
+    p = Profile()
+    t0 = time()
+    p.enable()
+    while step():
+        dirty.update(ID)
+    p.disable()
+    return (p, sim.frames, time() - t0, replayed)
+
+
+def profile_levels (game, IDs, options):
+    """Profile the given levels and write the results.
+
+profile_levels(game, IDs, options)
+
+game: the running Game instance.
+IDs: the levels to profile, in order.
+options: the options parsed by game.py.
+
+For each level, pstats data and a top-N summary are written to a new directory
+in options.profile_dir, named by the current time, along with the same for all
+levels together.  Levels are replayed from options.replay_dir, and are left idle
+for options.time seconds if there is no recording for them.
+
+"""
+    d = os.path.join(options.profile_dir, strftime('%Y%m%d-%H%M%S'))
+    try:
+        os.makedirs(d)
+    except OSError:
+        print 'warning: can\'t create directory: \'{0}\''.format(d)
+        return
+    frames = options.time * conf.FPS['level']
+    stats_fns = []
+    for ID in IDs:
+        p, n, t, replayed = profile_level(game, ID, frames,
+                                          options.replay_dir)
+        fn = os.path.join(d, 'level-{0}'.format(ID))
+        p.dump_stats(fn + '.prof')
+        stats_fns.append(fn + '.prof')
+        header = 'level {0}: {1} frames{2} in {3:.3f}s ({4:.3f}ms/frame)'
+        header = header.format(ID, n, '' if replayed else ', no recording', t,
+                               1000 * t / n if n else 0)
+        print header
+        _write_summary(fn + '.txt', [fn + '.prof'], header, options)
+    # aggregate
+    fn = os.path.join(d, 'all')
+    Stats(*stats_fns).dump_stats(fn + '.prof')
+    header = 'levels {0}'.format(', '.join(str(ID) for ID in IDs))
+    _write_summary(fn + '.txt', stats_fns, header, options)
+    s = Stats(fn + '.prof').strip_dirs().sort_stats(options.sort_stats)
+    s.print_stats(options.num_stats)
+    print 'info: wrote results to \'{0}\''.format(d)
@@ -0,0 +1,242 @@
+"""Level input recording and replay.
+
+A recording holds the input for one level, from the time it was started: the
+level, checkpoint and random seed it was started with, and each frame's input
+actions (level.INPUT_*, in the order they happened) and window movement.  The
+file format is a header
+
+    magic (4 bytes), version (uint8), level ID (uint16), checkpoint (int16),
+    seed (uint32)
+
+followed by runs of identical frames, each
+
+    count (uint16), number of actions (uint8), dx (int16), dy (int16),
+    actions (uint8 each)
+
+then a run with a count of 0 and no actions, and the player's (x, y) position
+(2 doubles) before each frame's update, as played live, for checking replays.
+The last part is missing if the game didn't close the recording.  All values
+are little-endian.
+
+"""
+
+import os
+import struct
+
+from sim import ScriptedInput, Simulation, idle_input
+
+MAGIC = 'WVRP'
+VERSION = 2
+HEADER = struct.Struct('<4sBHhI')
+RUN = struct.Struct('<HBhh')
+POS = struct.Struct('<2d')
+MAX_RUN = 0xffff
+MAX_ACTIONS = 0xff
+MAX_DELTA = 0x7fff
+
+
+class Recorder (object):
+    """Write a recording of level input to a file.
+
+    CONSTRUCTOR
+
+Recorder(fn, ID, cp, seed)
+
+fn: filename to write to.
+ID, cp, seed: the level, checkpoint and seed the level was started with.
+
+    METHODS
+
+frame
+trace
+close
+
+"""
+
+    def __init__ (self, fn, ID, cp, seed):
+        self._f = open(fn, 'wb')
+        self._f.write(HEADER.pack(MAGIC, VERSION, ID, cp, seed))
+        self._run = None
+        self._count = 0
+        self._trace = []
+
+    def frame (self, actions, delta):
+        """Record a frame's input.
+
+frame(actions, delta)
+
+actions: sequence of level.INPUT_* actions, in the order they happened.
+delta: (dx, dy) window movement.
+
+"""
+        m = MAX_DELTA
+        frame = (tuple(actions[:MAX_ACTIONS]), max(-m, min(delta[0], m)),
+                 max(-m, min(delta[1], m)))
+        if frame == self._run and self._count < MAX_RUN:
+            self._count += 1
+        else:
+            self._write_run()
+            self._run = frame
+            self._count = 1
+
+    def trace (self, pos):
+        """Record the player's position at the start of a frame's update."""
+        self._trace.append(POS.pack(pos[0], pos[1]))
+
+    def _write_run (self):
+        if self._count:
+            actions, dx, dy = self._run
+            self._f.write(RUN.pack(self._count, len(actions), dx, dy))
+            self._f.write(''.join(chr(action) for action in actions))
+
+    def close (self):
+        """Finish the recording and close the file."""
+        if self._f is not None:
+            self._write_run()
+            self._count = 0
+            self._f.write(RUN.pack(0, 0, 0, 0))
+            self._f.write(''.join(self._trace))
+            self._trace = []
+            self._f.close()
+            self._f = None
+
+    def __del__ (self):
+        self.close()
+
+
+class Replay (object):
+    """A recording loaded from a file.
+
+    CONSTRUCTOR
+
+Replay(fn)
+
+fn: filename to load from.
+
+Raises ValueError if the file isn't a valid recording.
+
+    METHODS
+
+input
+simulate
+
+    ATTRIBUTES
+
+ID, cp, seed: the level, checkpoint and seed the level was started with.
+runs: list of (count, actions, (dx, dy)) runs of identical frames, where
+      actions is a tuple of level.INPUT_* actions.
+frames: the total number of frames.
+trace: the player's (x, y) position before each frame's update, as played
+       live, or None if not recorded.
+
+"""
+
+    def __init__ (self, fn):
+        with open(fn, 'rb') as f:
+            data = f.read()
+        i = HEADER.size
+        if len(data) < i:
+            raise ValueError('not a recording: \'{0}\''.format(fn))
+        magic, version, self.ID, self.cp, self.seed = \
+            HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not a recording: \'{0}\''.format(fn))
+        self.runs = runs = []
+        self.trace = None
+        n = len(data)
+        while i < n:
+            if i + RUN.size > n:
+                raise ValueError('truncated recording: \'{0}\''.format(fn))
+            count, actions, dx, dy = RUN.unpack_from(data, i)
+            i += RUN.size
+            if count == 0:
+                # end of input: positions follow
+                if (n - i) % POS.size:
+                    raise ValueError(
+                        'truncated recording: \'{0}\''.format(fn)
+                    )
+                self.trace = [POS.unpack_from(data, j)
+                              for j in xrange(i, n, POS.size)]
+                break
+            else:
+                j = i + actions
+                if j > n:
+                    raise ValueError(
+                        'truncated recording: \'{0}\''.format(fn)
+                    )
+                actions = tuple(ord(c) for c in data[i:j])
+                i = j
+            runs.append((count, actions, (dx, dy)))
+        self.frames = sum(run[0] for run in runs)
+
+    def _frames (self):
+        for count, actions, delta in self.runs:
+            for i in xrange(count):
+                yield (actions, delta)
+
+    def input (self):
+        """Get a sim.ScriptedInput that plays back this recording."""
+        return ScriptedInput(self._frames())
+
+    def simulate (self, game, draw = False, trace = False, backend = False,
+                  mark = None):
+        """Get a sim.Simulation that plays back this recording.
+
+simulate(game, draw = False, trace = False, backend = False, mark = None)
+    -> sim
+
+game, draw, trace, backend, mark: as taken by sim.Simulation.
+
+"""
+        return Simulation(game, self.ID, self.cp, self.input(), draw,
+                          self.seed, trace, backend, mark)
+
+
+def load_level (d, ID):
+    """Load the recording for a level from a directory.
+
+load_level(d, ID) -> replay
+
+d: the directory to look in.
+ID: the level's ID.
+
+replay: a Replay instance, loaded from the file named '<ID>.replay', or None if
+        there's no such file or it can't be loaded.
+
+"""
+    fn = os.path.join(d, '{0}.replay'.format(ID))
+    if not os.path.exists(fn):
+        return None
+    try:
+        r = Replay(fn)
+    except (IOError, ValueError), e:
+        print 'warning: can\'t load recording: {0}'.format(e)
+        return None
+    if r.ID != ID:
+        print 'warning: recording is for the wrong level: \'{0}\''.format(fn)
+        return None
+    return r
+
+
+def simulate_level (game, d, ID, frames, **kwargs):
+    """Simulate a level from its recording, or idle if there isn't one.
+
+simulate_level(game, d, ID, frames, **kwargs) -> (sim, replayed)
+
+game: the running Game instance.
+d: the directory to look for the recording in (see load_level).
+ID: the level's ID.
+frames: the number of frames to leave the level idle for if there's no
+        recording.
+kwargs: draw, trace, backend and mark, as taken by sim.Simulation.
+
+sim: the sim.Simulation instance.
+replayed: whether the recording was found.
+
+"""
+    r = load_level(d, ID)
+    if r is None:
+        return (Simulation(game, ID, inp = idle_input(frames), **kwargs),
+                False)
+    else:
+        return (r.simulate(game, **kwargs), True)
@@ -0,0 +1,140 @@
+"""Statistical sampling profiler.
+
+A Sampler runs a thread that periodically looks at the stack of the thread that
+created it, and counts how often each stack is seen.  Results are written in
+the 'collapsed' format taken by flame graph tools: one line per stack, with
+frames outermost first, separated by semicolons, followed by the count.
+
+Only Python frames are seen, and the sampling thread needs the GIL to take a
+sample, so it only runs when the sampled thread lets go of it.  Time in C code
+that keeps the GIL (such as most of Pygame's drawing) delays the sample until
+the sampled thread next switches threads, and is credited to whatever Python
+code is running then, usually the caller or the code just after the call.
+Treat time attributed to functions that call into Pygame with suspicion.  Each
+sample also makes the sampled thread wait for the GIL briefly, so keep the rate
+low (see conf.SAMPLE_INTERVAL) to keep frame timing realistic.
+
+"""
+
+import sys
+import os
+import thread
+import threading
+from time import sleep, strftime
+
+from conf import conf
+
+
+class Sampler (object):
+    """Samples the creating thread's stack.
+
+    CONSTRUCTOR
+
+Sampler(interval = conf.SAMPLE_INTERVAL)
+
+interval: time between samples, in seconds.
+
+    METHODS
+
+start
+stop
+toggle
+write
+
+    ATTRIBUTES
+
+interval: as taken by the constructor.
+running: whether sampling is in progress.
+samples: {stack: count}, where stack is a tuple of code objects, outermost
+         first.
+
+"""
+
+    def __init__ (self, interval = conf.SAMPLE_INTERVAL):
+        self.interval = interval
+        self.running = False
+        self.samples = {}
+        self._ident = thread.get_ident()
+        self._thread = None
+
+    def start (self):
+        """Start sampling, discarding any previous samples."""
+        if self.running:
+            return
+        self.samples = {}
+        self.running = True
+        self._thread = t = threading.Thread(target = self._run)
+        t.daemon = True
+        t.start()
+
+    def stop (self):
+        """Stop sampling and wait for the sampling thread to finish."""
+        if not self.running:
+            return
+        self.running = False
+        self._thread.join()
+        self._thread = None
+
+    def toggle (self, *args):
+        """Start sampling, or stop and write the results."""
+        if self.running:
+            self.stop()
+            self.write()
+        else:
+            self.start()
+            print 'info: sampling profiler started'
+
+    def _run (self):
+        samples = self.samples
+        ident = self._ident
+        interval = self.interval
+        get_frames = sys._current_frames
+        while self.running:
+            sleep(interval)
+            f = get_frames().get(ident)
+            stack = []
+            while f is not None:
+                stack.append(f.f_code)
+                f = f.f_back
+            if stack:
+                stack.reverse()
+                stack = tuple(stack)
+                samples[stack] = samples.get(stack, 0) + 1
+
+    def write (self, fn = None):
+        """Write samples in collapsed format.
+
+write([fn]) -> fn
+
+fn: file to write to; defaults to conf.SAMPLE_FILE, formatted with the current
+    time.
+
+"""
+        if fn is None:
+            fn = conf.SAMPLE_FILE.format(strftime('%Y%m%d-%H%M%S'))
+        names = {}
+
+        def name (code):
+            n = names.get(code)
+            if n is None:
+                n = names[code] = '{0}:{1}'.format(
+                    os.path.basename(code.co_filename), code.co_name
+                ).replace(';', ':')
+            return n
+
+        # merge stacks whose code objects have the same names
+        lines = {}
+        for stack, n in self.samples.iteritems():
+            line = ';'.join(name(code) for code in stack)
+            lines[line] = lines.get(line, 0) + n
+        try:
+            with open(fn, 'w') as f:
+                for line, n in sorted(lines.iteritems()):
+                    f.write('{0} {1}\n'.format(line, n))
+        except IOError:
+            print 'warning: can\'t write to file: \'{0}\''.format(fn)
+        else:
+            print 'info: wrote {0} samples to \'{1}\''.format(
+                sum(lines.itervalues()), fn
+            )
+        return fn
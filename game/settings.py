@@ -2,6 +2,10 @@ import os
 from copy import deepcopy
 import json
 from collections import defaultdict
+from threading import Thread, Condition
+from time import time
+
+from util import write_file
 
 
 class JSONEncoder (json.JSONEncoder):
@@ -35,6 +39,7 @@ To restore a setting to its default value, delete it.
     METHODS
 
 dump
+flush
 
 """
 
@@ -74,24 +79,40 @@ dump
         """Force saving all settings."""
         pass
 
+    def flush (self):
+        """Wait until all saved settings have been written."""
+        pass
+
 
 class SettingsManager (DummySettingsManager):
     """An object for handling settings; DummySettingsManager subclass.
 
     CONSTRUCTOR
 
-SettingsManager(settings, fn, save[, types])
+SettingsManager(settings, fn, save[, types], delay = .5)
 
 settings, types: as take by DummySettingsManager.
 fn: filename to save settings in.
 save: a list containing the names of the settings to save to fn (others are
       stored in memory only).
+delay: time in seconds to wait after a change before writing, so that a burst
+       of changes results in a single write.
+
+Settings are written by a background thread, by writing to a temporary file
+and renaming it over fn.  Call flush before exiting to make sure the last
+changes are written.
 
 """
 
-    def __init__ (self, settings, fn, save, types = {}):
+    def __init__ (self, settings, fn, save, types = {}, delay = .5):
         DummySettingsManager.__init__(self, settings, types)
         self._fn = fn
+        self._delay = delay
+        # writer state, protected by _cond
+        self._cond = Condition()
+        self._pending = None
+        self._writing = False
+        self._flushing = False
         # create directory
         d = os.path.dirname(fn)
         try:
@@ -114,6 +135,10 @@ save: a list containing the names of the settings to save to fn (others are
                 DummySettingsManager.__setattr__(self, k, v)
         settings = self._settings
         self._save = dict((k, settings[k]) for k in save)
+        # start writer
+        writer = Thread(target = self._write_loop)
+        writer.daemon = True
+        writer.start()
 
     def __setattr__ (self, k, v):
         done, v = DummySettingsManager.__setattr__(self, k, v)
@@ -126,11 +151,57 @@ save: a list containing the names of the settings to save to fn (others are
             self.dump(False)
 
     def dump (self, public = True):
-        """Force saving all settings."""
+        """Force saving all settings.
+
+This only queues the write; see the class docstring.
+
+"""
         if public:
             print 'info: saving settings'
+        # values may be changed in place after this, so copy them now
+        data = deepcopy(self._save)
+        with self._cond:
+            self._pending = data
+            self._cond.notify_all()
+
+    def flush (self):
+        """Wait until all saved settings have been written."""
+        cond = self._cond
+        with cond:
+            self._flushing = True
+            cond.notify_all()
+            while self._pending is not None or self._writing:
+                cond.wait()
+            self._flushing = False
+
+    def _write_loop (self):
+        """Background writer: write queued settings."""
+        cond = self._cond
+        while True:
+            with cond:
+                while self._pending is None:
+                    cond.wait()
+                # wait for any more changes, unless we're being flushed
+                t = time() + self._delay
+                while not self._flushing:
+                    remain = t - time()
+                    if remain <= 0:
+                        break
+                    cond.wait(remain)
+                data = self._pending
+                self._pending = None
+                self._writing = True
+            self._write(data)
+            with cond:
+                self._writing = False
+                cond.notify_all()
+
+    def _write (self, data):
+        """Write the given settings to the file."""
+        fn = self._fn
         try:
-            with open(self._fn, 'w') as f:
-                json.dump(self._save, f, indent = 4, cls = JSONEncoder)
-        except IOError:
-            print 'warning: can\'t write to file: \'{0}\''.format(self._fn)
+            write_file(fn, lambda f: json.dump(data, f, indent = 4,
+                                               cls = JSONEncoder),
+                       sync = True)
+        except (IOError, OSError):
+            print 'warning: can\'t write to file: \'{0}\''.format(fn)
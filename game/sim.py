@@ -0,0 +1,185 @@
+"""Headless level simulation.
+
+A Simulation drives a level.Level directly, without the mouse or frame timing,
+so frames advance as fast as they can be computed.  With SDL's dummy video
+driver, it doesn't need a window either.  This is the one place that plays
+scripted input into a level: benchmarks and profiling use it too.
+
+"""
+
+from time import time
+from itertools import repeat
+
+import level
+
+
+class ScriptedInput (object):
+    """Level input source that plays back a sequence of frames.
+
+    CONSTRUCTOR
+
+ScriptedInput(frames)
+
+frames: iterable of (actions, (dx, dy)) for each frame, where actions is a
+        sequence of level.INPUT_* actions, in order, and (dx, dy) is the amount
+        to move the window by.
+
+    METHODS
+
+next_frame
+window_delta
+
+    ATTRIBUTES
+
+delta: the window movement for the current frame.
+
+"""
+
+    def __init__ (self, frames):
+        self._frames = iter(frames)
+        self.delta = (0, 0)
+
+    def next_frame (self):
+        """Move on to the next frame.
+
+next_frame() -> actions
+
+actions: the input actions for the frame, or None if there are no frames left.
+
+"""
+        try:
+            actions, self.delta = next(self._frames)
+        except StopIteration:
+            return None
+        return actions
+
+    def window_delta (self, level):
+        """Get the amount to move the window by this frame."""
+        return self.delta
+
+
+def idle_input (frames):
+    """Create a ScriptedInput with no input for the given number of frames."""
+    return ScriptedInput(repeat(((), (0, 0)), frames))
+
+
+class Simulation (object):
+    """Run a level headlessly.
+
+    CONSTRUCTOR
+
+Simulation(game, ID = 0, cp = -1, inp = None, draw = False[, seed],
+           trace = False, backend = False, mark = None)
+
+game: the running Game instance, used to load graphics.
+ID, cp: the level and checkpoint to start at.
+inp: a ScriptedInput (or compatible) to take input from; defaults to 10 seconds
+     of no input.
+draw: whether to draw the level to game.screen every frame, or a function to
+      call with the level instead, to draw it however the caller wants.
+      Drawing doesn't affect play, so recordings replay the same either way.
+seed: the seed for the level's random numbers.
+trace: whether to record the player's position in each frame.
+backend: whether to start the level as the game's current backend, with an
+         event handler that is updated every frame.  The simulation stops if
+         the level stops being the current backend (for example, if it's
+         paused).
+mark: a function to call after each phase of a frame with the phase's name:
+      'events' (only if backend is True), 'update' and 'draw' (only if
+      drawing).
+
+The level never records input or saves progress.
+
+    METHODS
+
+step
+run
+
+    ATTRIBUTES
+
+level: the simulated level.Level instance.
+frames: the number of frames simulated so far.
+trace: if tracing, the player's (x, y) position after each frame's input is
+       applied and before the level is updated, as recorded by
+       replay.Recorder; else None.
+
+"""
+
+    def __init__ (self, game, ID = 0, cp = -1, inp = None, draw = False,
+                  seed = None, trace = False, backend = False, mark = None):
+        self.game = game
+        if inp is None:
+            inp = idle_input(10 * 60)
+        self.input = inp
+        self.draw = draw
+        self.backend = backend
+        self.mark = mark
+        if backend:
+            l = game.switch_backend(level.Level, ID, cp, seed,
+                                    save_progress = False)
+        else:
+            l = level.Level(game, None, ID, cp, seed, save_progress = False)
+        self.level = l
+        l.input = inp
+        self.frames = 0
+        self.trace = [] if trace else None
+
+    def step (self):
+        """Simulate one frame.
+
+step() -> running
+
+running: False if the input has run out, the level was won or it stopped being
+         the current backend (in which case no more of the frame was
+         simulated).
+
+"""
+        l = self.level
+        mark = self.mark
+        if l.winning:
+            return False
+        if self.backend:
+            if self.game.backend is not l:
+                return False
+            l.event_handler.update()
+            if mark is not None:
+                mark('events')
+            if self.game.backend is not l:
+                return False
+        actions = self.input.next_frame()
+        if actions is None:
+            return False
+        l.apply_input(actions)
+        if self.trace is not None:
+            self.trace.append(tuple(l.player.rect[:2]))
+        l.update()
+        if mark is not None:
+            mark('update')
+        draw = self.draw
+        if draw:
+            if draw is True:
+                l.draw(self.game.screen)
+            else:
+                draw(l)
+            if mark is not None:
+                mark('draw')
+        self.frames += 1
+        return True
+
+    def run (self, frames = None):
+        """Simulate until the input runs out or the level is won.
+
+run([frames]) -> (frames, t)
+
+frames: maximum number of frames to simulate.
+
+frames: the number of frames simulated.
+t: the time taken, in seconds.
+
+"""
+        step = self.step
+        n = 0
+        t0 = time()
+        while (frames is None or n < frames) and step():
+            n += 1
+        return (n, time() - t0)
@@ -0,0 +1,182 @@
+"""Always-on frame telemetry, dumped to a file when a frame takes too long."""
+
+import os
+import csv
+from time import strftime
+from collections import deque
+from threading import Thread, Condition
+
+from conf import conf
+from util import write_file
+from ext.sched import clock
+
+# per-frame counters, in the order they're written
+COUNTERS = ('particles', 'dirty_rects', 'dirty_pixels', 'collisions',
+            'sounds')
+
+
+class Telemetry (object):
+    """Keeps frame lengths and counters for the most recent frames.
+
+    CONSTRUCTOR
+
+Telemetry(describe = None, n = conf.TELEMETRY_FRAMES,
+          budget = conf.HITCH_TIME)
+
+describe: a function returning a list of lines describing the game's state, to
+          be included in dumps.
+n: the number of frames to keep.
+budget: frames longer than this, in seconds, cause a dump (if conf.HITCH_DIR is
+        not None).
+
+Counters are reset at the end of each frame.  After a dump, there's no other
+until the buffer has filled with new frames, and there are at most
+conf.HITCH_MAX_DUMPS each session.
+
+Dumps are written by a background thread, so that writing doesn't make the
+hitch worse or cause another.  Call flush before exiting to make sure they're
+all written.
+
+    METHODS
+
+count
+set
+end_frame
+dump
+flush
+
+    ATTRIBUTES
+
+frames: (frame, ident, length, counts) for each frame, oldest first, where
+        length is in seconds and counts is a tuple in the order of COUNTERS.
+counters: {name: count} for the current frame.
+dumps: the number of dumps written so far.
+
+"""
+
+    def __init__ (self, describe = None, n = conf.TELEMETRY_FRAMES,
+                  budget = conf.HITCH_TIME):
+        self.describe = describe
+        self.budget = budget
+        self.frames = deque(maxlen = n)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.dumps = 0
+        self._t = None
+        # frames until we may dump again
+        self._wait = 0
+        # writer state, protected by _cond
+        self._cond = Condition()
+        self._pending = []
+        self._writing = False
+        self._writer = None
+
+    def count (self, name, n = 1):
+        """Add to a counter for the current frame."""
+        self.counters[name] += n
+
+    def set (self, name, n):
+        """Set a counter for the current frame."""
+        self.counters[name] = n
+
+    def end_frame (self, frame, ident):
+        """Record the current frame and start a new one.
+
+end_frame(frame, ident)
+
+frame: the frame's number.
+ident: identifier to record the frame under, such as a backend ID.
+
+The frame's length is the time since the last call.
+
+"""
+        t = clock()
+        t0 = self._t
+        self._t = t
+        length = 0 if t0 is None else t - t0
+        c = self.counters
+        self.frames.append((frame, ident, length,
+                            tuple(c[name] for name in COUNTERS)))
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        if self._wait:
+            self._wait -= 1
+        elif length > self.budget and self.dumps < conf.HITCH_MAX_DUMPS:
+            self.dump()
+            self._wait = self.frames.maxlen
+            # don't count the time taken to queue the dump against the next
+            # frame
+            self._t = clock()
+
+    def dump (self):
+        """Queue writing the buffer to a new file in conf.HITCH_DIR.
+
+dump() -> fn
+
+fn: the file to be written to, or None if dumping is disabled.
+
+"""
+        d = conf.HITCH_DIR
+        if d is None:
+            return None
+        self.dumps += 1
+        fn = os.path.join(d, 'hitch-{0}-{1}.csv'.format(
+            strftime('%Y%m%d-%H%M%S'), self.dumps
+        ))
+        # the game's state has to be read now, on this thread
+        frame, ident, length, counts = self.frames[-1]
+        header = ['frame {0} ({1}) took {2:.2f}ms; budget is {3:.2f}ms'.format(
+            frame, ident, 1000 * length, 1000 * self.budget
+        )]
+        if self.describe is not None:
+            header += self.describe()
+        with self._cond:
+            self._pending.append((fn, header, list(self.frames)))
+            if self._writer is None:
+                self._writer = writer = Thread(target = self._write_loop)
+                writer.daemon = True
+                writer.start()
+            self._cond.notify_all()
+        return fn
+
+    def flush (self):
+        """Wait until all queued dumps have been written."""
+        cond = self._cond
+        with cond:
+            while self._pending or self._writing:
+                cond.wait()
+
+    def _write_loop (self):
+        """Background writer: write queued dumps."""
+        cond = self._cond
+        while True:
+            with cond:
+                while not self._pending:
+                    cond.wait()
+                dump = self._pending.pop(0)
+                self._writing = True
+            self._write(*dump)
+            with cond:
+                self._writing = False
+                cond.notify_all()
+
+    def _write (self, fn, header, frames):
+        """Write a dump to a file."""
+
+        def write (f):
+            for line in header:
+                f.write('# {0}\n'.format(line))
+            w = csv.writer(f)
+            w.writerow(('frame', 'ident', 'ms') + COUNTERS)
+            for frame, ident, length, counts in frames:
+                w.writerow((frame, ident, '{0:.4f}'.format(1000 * length))
+                           + counts)
+
+        d = os.path.dirname(fn)
+        try:
+            if not os.path.isdir(d):
+                os.makedirs(d)
+            write_file(fn, write, mode = 'wb')
+        except (IOError, OSError):
+            print 'warning: can\'t write to file: \'{0}\''.format(fn)
+            return
+        if conf.DEBUG:
+            print 'info: wrote hitch report to \'{0}\''.format(fn)
@@ -0,0 +1,231 @@
+"""Level thumbnails.
+
+Thumbnails are drawn straight from level data at their final size by render,
+and stored in conf.THUMB_DIR as raw RGB pixel data.  Files are named by level,
+size and a hash of everything else that affects how they look (level data,
+progress, resolution and the images in conf.IMG_DIR), so any change just results
+in a different file.  Saving a thumbnail removes any others for the same level
+and size.
+
+"""
+
+import os
+from hashlib import sha1
+
+import pygame as pg
+from pygame import Rect
+
+from conf import conf
+from util import ir, write_file
+from obj import player_frames
+import level
+
+# change this when thumbnails are drawn differently
+VERSION = 2
+# signature of the image files, computed when first needed
+_assets = None
+
+
+def _assets_sig ():
+    # names, sizes and modification times of the images thumbnails are drawn
+    # from
+    global _assets
+    if _assets is None:
+        d = conf.IMG_DIR
+        sig = []
+        try:
+            fns = sorted(os.listdir(d))
+        except OSError:
+            fns = []
+        for fn in fns:
+            try:
+                s = os.stat(os.path.join(d, fn))
+            except OSError:
+                continue
+            sig.append((fn, s.st_size, int(s.st_mtime)))
+        _assets = sig
+    return _assets
+
+
+def key (ID, size, completed, stars):
+    """Get the cache key for a level thumbnail.
+
+key(ID, size, completed, stars) -> key
+
+ID: the level's ID.
+size: the (width, height) size of the thumbnail.
+completed: whether the level has been completed.
+stars: indices of stars collected in the level.
+
+key: a string suitable for use in a filename.
+
+"""
+    data = sorted(conf.LEVELS[ID].iteritems())
+    h = sha1(repr((VERSION, data, tuple(conf.RES), bool(completed),
+                   sorted(stars), _assets_sig())))
+    return '{0}-{1}'.format(_prefix(ID, size), h.hexdigest())
+
+
+def _prefix (ID, size):
+    # the part of a key that identifies the thumbnail, not its contents
+    return '{0}-{1}x{2}'.format(ID, *size)
+
+
+def _fn (k):
+    return os.path.join(conf.THUMB_DIR, k + '.rgb')
+
+
+def _prune (k):
+    # remove other thumbnails for the same level and size as key k
+    prefix = k[:k.rindex('-') + 1]
+    keep = os.path.basename(_fn(k))
+    try:
+        fns = os.listdir(conf.THUMB_DIR)
+    except OSError:
+        return
+    for fn in fns:
+        if fn.startswith(prefix) and fn.endswith('.rgb') and fn != keep:
+            try:
+                os.remove(os.path.join(conf.THUMB_DIR, fn))
+            except OSError:
+                pass
+
+
+def load (k, size):
+    """Load a thumbnail from the cache.
+
+load(k, size) -> sfc
+
+k: the thumbnail's cache key, as returned by key.
+size: the thumbnail's size.
+
+sfc: the loaded surface, or None if it isn't cached (or caching is disabled).
+
+"""
+    if conf.THUMB_DIR is None:
+        return None
+    size = tuple(size)
+    try:
+        with open(_fn(k), 'rb') as f:
+            data = f.read()
+    except IOError:
+        return None
+    if len(data) != 3 * size[0] * size[1]:
+        # corrupt: just make it again
+        return None
+    return pg.image.fromstring(data, size, 'RGB').convert()
+
+
+def save (k, sfc):
+    """Store a thumbnail in the cache.
+
+save(k, sfc)
+
+k: the thumbnail's cache key, as returned by key.
+sfc: the thumbnail.
+
+"""
+    d = conf.THUMB_DIR
+    if d is None:
+        return
+    fn = _fn(k)
+    try:
+        if not os.path.isdir(d):
+            os.makedirs(d)
+        data = pg.image.tostring(sfc, 'RGB')
+        write_file(fn, lambda f: f.write(data), 'wb')
+    except (IOError, OSError):
+        print 'warning: can\'t write to file: \'{0}\''.format(fn)
+    else:
+        _prune(k)
+
+
+def render (game, ID, size, completed, stars):
+    """Draw a level's thumbnail.
+
+render(game, ID, size, completed, stars) -> sfc
+
+game: the running game.Game instance, to load images from.
+ID, size, completed, stars: as taken by key.
+
+This draws the level as it looks when started, without clouds, directly at the
+thumbnail's size from conf.LEVELS, using images scaled down to match.
+
+"""
+    data = conf.LEVELS[ID]
+    w, h = size
+    res_w, res_h = conf.RES
+    sx = float(w) / res_w
+    sy = float(h) / res_h
+
+    def scale_rect (r):
+        x, y, rw, rh = r
+        x0, y0 = ir(x * sx), ir(y * sy)
+        return Rect(x0, y0, ir((x + rw) * sx) - x0, ir((y + rh) * sy) - y0)
+
+    def img (name, rect = None):
+        # image scaled by the thumbnail's scale, or to the given scaled rect
+        fn = name + '.png'
+        if rect is None:
+            rect = scale_rect((0, 0) + game.img(fn).get_size())
+        return game.img(fn, (max(rect[2], 1), max(rect[3], 1)))
+
+    sfc = pg.Surface(size).convert_alpha()
+    # void, vrects
+    level.tile(sfc, img('void'), (0, 0, w, h))
+    t = img('vrect')
+    for r in data.get('vrects', []):
+        level.tile(sfc, t, scale_rect(r))
+    # window: centred on the player, as in level.Level
+    hw, hh = conf.HALF_WINDOW_SIZE
+    x, y = Rect(data['player_pos'], conf.PLAYER_SIZE).center
+    win = Rect(x - hw, y - hh, 2 * hw, 2 * hh)
+    w_rect = scale_rect(win)
+    offset = (-w_rect[0], -w_rect[1])
+    w_sfc = pg.Surface(w_rect.size).convert_alpha()
+    for bg in data.get('bgs', conf.DEFAULT_BGS):
+        if isinstance(bg, str):
+            pos = (0, 0)
+        else:
+            bg, pos = bg
+        w_sfc.blit(img(bg), scale_rect(pos + (0, 0)).move(offset))
+    t = img('rect')
+    for r in data.get('rects', []):
+        r = Rect(r)
+        c = r.clip(win)
+        if c:
+            level.tile(w_sfc, t, scale_rect(c).move(offset),
+                       full = scale_rect(r).move(offset))
+    s = conf.CHECKPOINT_SIZE
+    for p in data.get('checkpoints', []):
+        r = scale_rect(tuple(p) + s)
+        w_sfc.blit(img('checkpoint', r), r.move(offset))
+    w_sfc.blit(img('window', w_rect), (0, 0), None, pg.BLEND_RGBA_MULT)
+    sfc.blit(w_sfc, w_rect)
+    # arects, goal
+    t = img('arect')
+    for r in data.get('arects', []):
+        level.tile(sfc, t, scale_rect(r))
+    g_w, g_h = game.img('goal.png').get_size()
+    r = Rect(data['goal'], (g_w, g_h)).move(conf.GOAL_OFFSET)
+    r = scale_rect(r)
+    sfc.blit(img('goal', r), r)
+    # stars (not glowing)
+    for i, p in enumerate(data.get('stars', [])):
+        if i not in stars:
+            r = scale_rect(tuple(p) + conf.STAR_SIZE)
+            sfc.blit(img('star-bg', r), r)
+    # player, in its initial pose
+    player_frames.load(game)
+    frame = player_frames.frames[(0, True, True)]
+    ox, oy = conf.PLAYER_OFFSET
+    x, y = data['player_pos']
+    r = scale_rect((ir(x) + ox, ir(y) + oy) + frame.get_size())
+    if r.w > 0 and r.h > 0:
+        sfc.blit(player_frames.get((0, True, True), r.size), r)
+    # dim if completed
+    if completed:
+        mod_sfc = pg.Surface(size).convert_alpha()
+        mod_sfc.fill(conf.LS_WON_OVERLAY)
+        sfc.blit(mod_sfc, (0, 0))
+    return sfc.convert()
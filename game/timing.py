@@ -0,0 +1,139 @@
+"""Per-phase frame timing, with an on-screen graph and CSV export."""
+
+import csv
+from collections import deque
+
+import pygame as pg
+
+from conf import conf
+from ext.sched import clock
+
+PHASES = ('events', 'update', 'overlay', 'draw', 'display')
+
+
+class FrameTimer (object):
+    """Times the phases of each frame.
+
+    CONSTRUCTOR
+
+FrameTimer(n = conf.TIMING_FRAMES)
+
+n: the number of frames to keep timings for.
+
+Timing is off to begin with; while it's off, nothing is recorded, and callers
+should check the enabled attribute before calling any other methods, so that it
+costs next to nothing.
+
+    METHODS
+
+toggle
+start
+mark
+end
+draw
+export
+
+    ATTRIBUTES
+
+enabled: whether timings are being recorded.
+frames: recorded (ident, times) for each frame, where times is a
+        {phase: seconds} dict, oldest first.
+rect: where the graph is drawn on the screen.
+
+"""
+
+    def __init__ (self, n = conf.TIMING_FRAMES):
+        self.enabled = False
+        self.frames = deque(maxlen = n)
+        self.rect = None
+        self._sfc = None
+        self._times = None
+        self._t = None
+
+    def toggle (self, *args):
+        """Turn timing and the graph on or off."""
+        self.enabled = not self.enabled
+        self._sfc = None
+
+    def start (self):
+        """Start timing a frame."""
+        self._times = dict.fromkeys(PHASES, 0)
+        self._t = clock()
+
+    def mark (self, phase):
+        """Add the time since the last mark (or start) to the given phase.
+
+If phase is None, the time isn't counted.
+
+"""
+        t = clock()
+        if phase is not None:
+            self._times[phase] += t - self._t
+        self._t = t
+
+    def end (self, ident):
+        """Finish timing a frame.
+
+end(ident)
+
+ident: identifier to record the frame under, such as a backend ID.
+
+"""
+        times = self._times
+        self.frames.append((ident, times))
+        self._times = None
+        if not self.enabled:
+            # turned off this frame
+            return
+        # add a column to the graph
+        sfc = self._sfc
+        if sfc is None:
+            self._sfc = sfc = pg.Surface(conf.TIMING_HUD_SIZE).convert()
+            sfc.fill(conf.TIMING_HUD_BG)
+        w, h = sfc.get_size()
+        sfc.scroll(-1, 0)
+        sfc.fill(conf.TIMING_HUD_BG, (w - 1, 0, 1, h))
+        # a full frame at the target rate is half the height
+        scale = .5 * h * conf.FPS[ident]
+        y = h
+        for phase in PHASES:
+            dy = int(round(times[phase] * scale))
+            if dy > 0:
+                y -= dy
+                sfc.fill(conf.TIMING_COLOURS[phase], (w - 1, y, 1, dy))
+        sfc.set_at((w - 1, h / 2), conf.TIMING_HUD_LINE)
+
+    def draw (self, screen):
+        """Draw the graph to the screen and return the rect drawn in."""
+        sfc = self._sfc
+        if sfc is None:
+            return None
+        # bottom-left corner
+        self.rect = r = sfc.get_rect(bottomleft = (0, screen.get_height()))
+        screen.blit(sfc, r)
+        return r
+
+    def export (self, *args):
+        """Write timings to a CSV file for each identifier.
+
+Files are named by conf.TIMING_FILE.  Times are in milliseconds.
+
+"""
+        by_ident = {}
+        for ident, times in self.frames:
+            by_ident.setdefault(ident, []).append(times)
+        for ident, frames in by_ident.iteritems():
+            fn = conf.TIMING_FILE.format(ident)
+            try:
+                with open(fn, 'wb') as f:
+                    w = csv.writer(f)
+                    w.writerow(('frame',) + PHASES + ('total',))
+                    for i, times in enumerate(frames):
+                        ts = [1000 * times[phase] for phase in PHASES]
+                        w.writerow([i] + ['{0:.4f}'.format(t)
+                                          for t in ts + [sum(ts)]])
+            except IOError:
+                print 'warning: can\'t write to file: \'{0}\''.format(fn)
+            else:
+                print 'info: wrote {0} frames to \'{1}\''.format(len(frames),
+                                                                 fn)
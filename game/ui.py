@@ -1,8 +1,11 @@
+from time import time
+
 import pygame as pg
 from ext import evthandler as eh
 
 from conf import conf
 import level
+import thumb
 from util import ir, split
 
 def draw_rect (surface, colour, rect, width = 1):
@@ -85,25 +88,22 @@ class LevelSelect (object):
         hs = split(ir(h * float(rows) / cols), rows)
         x = w_i = h_i = 0
         y = (h - sum(hs)) / 2
-        draw_sfc = pg.Surface(conf.RES)
+        # thumbnails still to generate, as (ID, size)
+        self.pending = []
         vertical_order = []
         row = []
         vertical_order.append(row)
         for j, i in enumerate(ids):
             row.append(i)
             rect = pg.Rect((x, y, ws[w_i], hs[h_i])).inflate(-2, -2)
-            # generate image
-            sfc = pg.Surface(rect[2:])
-            l = level.Level(game, None, i)
-            l.draw(draw_sfc)
-            sfc = pg.transform.smoothscale(draw_sfc, rect[2:])
-            # dim or brighten surface
-            if i in conf.COMPLETED_LEVELS:
-                mod_sfc = pg.Surface(rect[2:]).convert_alpha()
-                mod_sfc.fill(conf.LS_WON_OVERLAY)
-                sfc.blit(mod_sfc, (0, 0))
             level_ids[i] = j
-            levels.append((i, rect, sfc.convert()))
+            sfc = self.thumbnail(i, rect.size, False)
+            if sfc is None:
+                # show a placeholder until generated
+                sfc = pg.Surface(rect.size)
+                sfc.fill(conf.LS_PLACEHOLDER_COLOUR)
+                self.pending.append((i, rect.size))
+            levels.append((i, rect, sfc))
             # get next rect
             x += ws[w_i]
             w_i += 1
@@ -119,6 +119,66 @@ class LevelSelect (object):
         self.set_current_from_mouse()
         self.vertical_order = sum([[row[i] for row in vertical_order if len(row) > i] for i in xrange(cols)], [])
         self.finished = False
+        if self.pending:
+            game.scheduler.add_timeout(self.generate, frames = 1)
+
+    def thumbnail (self, ID, size, generate = True):
+        """Get a level's thumbnail, from the cache if possible.
+
+thumbnail(ID, size, generate = True) -> sfc
+
+ID: the level's ID.
+size: the (width, height) size of the thumbnail.
+generate: whether to render the thumbnail if it isn't cached; if False and it
+          isn't, None is returned.
+
+"""
+        completed = ID in conf.COMPLETED_LEVELS
+        stars = [i for l_ID, i in conf.STARS if l_ID == ID]
+        k = thumb.key(ID, size, completed, stars)
+        sfc = thumb.load(k, size)
+        if sfc is not None or not generate:
+            return sfc
+        sfc = thumb.render(self.game, ID, size, completed, stars)
+        thumb.save(k, sfc)
+        return sfc
+
+    def generate (self):
+        """Generate pending thumbnails, within the per-frame time budget.
+
+Called every frame by the scheduler until there are none left.  The
+highlighted level is done first.
+
+"""
+        if self.finished or self.game.backend is not self:
+            # we're gone: stop
+            self.pending = []
+            return False
+        pending = self.pending
+        t0 = time()
+        while pending:
+            # prioritise current level
+            for j, (ID, size) in enumerate(pending):
+                if ID == self.current:
+                    break
+            else:
+                j = 0
+            ID, size = pending.pop(j)
+            j = self.level_ids[ID]
+            i, rect, sfc = self.levels[j]
+            self.levels[j] = (i, rect, self.thumbnail(ID, size))
+            self.mark_changed(ID)
+            if time() - t0 >= conf.LS_THUMB_BUDGET:
+                break
+        return bool(pending)
+
+    def mark_changed (self, *IDs):
+        """Mark the given levels' thumbnails as needing to be redrawn."""
+        changed = self.changed
+        if not changed:
+            self.changed = changed = []
+        changed.extend(ID for ID in IDs
+                       if ID is not None and ID not in changed)
 
     def set_current_from_mouse (self, evt = None):
         if evt is None:
@@ -177,8 +237,7 @@ class LevelSelect (object):
 
     def update (self):
         if self.current != self.last_current:
-            self.changed = [x for x in (self.current, self.last_current) \
-                            if x is not None]
+            self.mark_changed(self.current, self.last_current)
             self.last_current = self.current
 
     def draw (self, screen):
@@ -186,7 +245,7 @@ class LevelSelect (object):
         if self.dirty:
             screen.fill(conf.LS_BG_COLOUR)
         elif self.changed:
-            levels = [levels[j] for j in self.changed]
+            levels = [levels[self.level_ids[ID]] for ID in self.changed]
             self.changed = False
         else:
             return False
@@ -228,6 +287,7 @@ class Paused (object):
         event_handler.add_key_handlers(key_handlers)
 
     def back (self, *args):
+        self.level.stop_recording()
         self.game.quit_backend()
         self.game.switch_backend(LevelSelect)
 
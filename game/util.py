@@ -1,3 +1,4 @@
+import os
 from collections import defaultdict
 
 import pygame as pg
@@ -64,6 +65,37 @@ size_list: a list of sizes for each interval in turn.
     return sizes
 
 
+# files
+
+
+def write_file (fn, write, mode = 'w', sync = False):
+    """Replace a file's contents, never leaving it partly written.
+
+write_file(fn, write, mode = 'w', sync = False)
+
+fn: the file to write to.
+write: a function that takes an open file and writes the new contents to it.
+mode: mode to open the file with: 'w' or 'wb'.
+sync: whether to make sure the contents are on disk before replacing the file.
+
+The contents are written to a temporary file, which is then renamed over fn.
+Raises IOError or OSError on failure.
+
+"""
+    tmp = fn + '.tmp'
+    with open(tmp, mode) as f:
+        write(f)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+    try:
+        os.rename(tmp, fn)
+    except OSError:
+        # Windows won't rename over an existing file
+        os.remove(fn)
+        os.rename(tmp, fn)
+
+
 # graphics
 
 